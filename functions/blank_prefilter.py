@@ -0,0 +1,361 @@
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+import cv2 as cv
+import tensorflow as tf
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from metadata import DIR_DATA_RELATIVE, LABEL_COLUMNS, load_metadata
+from bucketing import load_image_for_model
+
+
+FILEPATH_PREFILTER = "../models/blank_prefilter.pkl"  # default location of the fitted prefilter
+THUMBNAIL_SIZE = (64, 36)  # (width, height) of the grayscale thumbnails used for background modelling
+IDX_BLANK = LABEL_COLUMNS.index("blank")  # index of the blank class in the model outputs
+
+
+def image_to_thumbnail(img: np.ndarray) -> np.ndarray:
+    """Convert a full-resolution image (BGR as loaded by OpenCV, or grayscale) into a small grayscale float32 thumbnail.
+
+    The prefilter is fit on thumbnails of the original files (see thumbnail_from_bytes), so the input must not be resized
+    to another aspect ratio (e.g. the model input) first.
+
+    Args:
+        img (np.ndarray): the image data.
+
+    Returns:
+        np.ndarray: the thumbnail with shape (THUMBNAIL_SIZE[1], THUMBNAIL_SIZE[0]).
+    """
+
+    if img.ndim == 3:
+        img = cv.cvtColor(img, cv.COLOR_BGR2GRAY)  # luma-weighted, like the grayscale decoding of the image files
+
+    return cv.resize(img, THUMBNAIL_SIZE, interpolation=cv.INTER_AREA).astype(np.float32)
+
+
+def thumbnail_from_bytes(image_bytes: bytes) -> np.ndarray:
+    """Decode an encoded image file (e.g. an upload) as grayscale at a reduced scale and return its thumbnail.
+
+    This is the single decoding path of all thumbnails, used for fitting the prefilter as well as for classifying uploads.
+
+    Args:
+        image_bytes (bytes): the raw bytes of the image file.
+
+    Returns:
+        np.ndarray: the thumbnail with shape (THUMBNAIL_SIZE[1], THUMBNAIL_SIZE[0]) (NaN if the image could not be decoded).
+    """
+
+    img = cv.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv.IMREAD_REDUCED_GRAYSCALE_4) if image_bytes else None
+    if img is None:
+        return np.full((THUMBNAIL_SIZE[1], THUMBNAIL_SIZE[0]), np.nan, dtype=np.float32)
+
+    return image_to_thumbnail(img)
+
+
+def load_thumbnails(filepaths: list[str]) -> np.ndarray:
+    """Load images and return their thumbnails (images are decoded at a reduced scale).
+
+    Args:
+        filepaths (list[str]): list of image file paths.
+
+    Returns:
+        np.ndarray: array of thumbnails with shape (n_images, THUMBNAIL_SIZE[1], THUMBNAIL_SIZE[0]) (unreadable images give NaN).
+    """
+
+    thumbnails = np.full((len(filepaths), THUMBNAIL_SIZE[1], THUMBNAIL_SIZE[0]), np.nan, dtype=np.float32)
+    for i, filepath in enumerate(filepaths):
+        try:
+            with open(filepath, "rb") as file:
+                thumbnails[i] = thumbnail_from_bytes(file.read())
+        except OSError:
+            pass  # missing files keep the NaN thumbnail
+
+    return thumbnails
+
+
+def build_site_backgrounds(thumbnails: np.ndarray, sites: np.ndarray) -> dict[str, np.ndarray]:
+    """Model the background of every camera site as the pixelwise median of its frames (robust against passing animals).
+
+    Args:
+        thumbnails (np.ndarray): the thumbnails of the frames.
+        sites (np.ndarray): the site of every frame.
+
+    Returns:
+        dict[str, np.ndarray]: dictionary mapping each site to its background thumbnail.
+    """
+
+    sites = np.asarray(sites, dtype=str)
+    backgrounds = {}
+    for site in np.unique(sites):
+        backgrounds[site] = np.nanmedian(thumbnails[sites == site], axis=0)
+
+    return backgrounds
+
+
+def _global_features(thumbnails: np.ndarray) -> np.ndarray:
+    """Site-independent features: brightness, contrast and edge energy of the thumbnails."""
+
+    grad_x = np.abs(np.diff(thumbnails, axis=2)).mean(axis=(1, 2))
+    grad_y = np.abs(np.diff(thumbnails, axis=1)).mean(axis=(1, 2))
+
+    return np.column_stack([thumbnails.mean(axis=(1, 2)), thumbnails.std(axis=(1, 2)), grad_x, grad_y])
+
+
+def _site_features(thumbnails: np.ndarray, backgrounds: np.ndarray) -> np.ndarray:
+    """Frame differencing features with respect to the site backgrounds."""
+
+    # remove global illumination changes before differencing
+    diff = np.abs((thumbnails - thumbnails.mean(axis=(1, 2), keepdims=True)) - (backgrounds - backgrounds.mean(axis=(1, 2), keepdims=True)))
+    diff_flat = diff.reshape(diff.shape[0], -1)
+
+    return np.column_stack([diff_flat.mean(axis=1), np.percentile(diff_flat, 95, axis=1), (diff_flat > 25).mean(axis=1)])
+
+
+def _recall_threshold(p_blank: np.ndarray, is_blank: np.ndarray, target_recall: float) -> float:
+    """Return the blank probability threshold above which frames are skipped, such that the recall of non-blank frames is kept at target_recall."""
+
+    p_non_blank = p_blank[~is_blank]
+    if p_non_blank.size == 0:
+        return 1.0
+
+    return float(np.quantile(p_non_blank, target_recall, method="higher"))
+
+
+def fit_blank_prefilter(df_fit: pd.DataFrame | None = None,
+                        df_calibration: pd.DataFrame | None = None,
+                        target_recall: float = 0.99,
+                        filepath: str | None = FILEPATH_PREFILTER) -> dict:
+    """Fit the blank-scene prefilter: per-site background models plus two tiny logistic regression classifiers
+    (one using frame differencing against the site background, one using site-independent features for images of unknown origin).
+
+    Args:
+        df_fit (pd.DataFrame | None, optional): metadata of the frames used for fitting (columns "filepath", "site", "blank"). Defaults to None, which uses the train split.
+        df_calibration (pd.DataFrame | None, optional): metadata of the frames used for choosing the thresholds. Defaults to None, which uses the validation split.
+        target_recall (float, optional): Minimum fraction of non-blank frames that must not be skipped. Defaults to 0.99.
+        filepath (str | None, optional): path for saving the fitted prefilter (not saved if None). Defaults to FILEPATH_PREFILTER.
+
+    Returns:
+        dict: the fitted prefilter.
+    """
+
+    columns = ["filepath", "site", "blank"]
+    if df_fit is None:
+        df_fit = load_metadata("train", columns=columns)
+    if df_calibration is None:
+        df_calibration = load_metadata("val", columns=columns)
+
+    # fit the background models and the classifiers
+    thumbnails_fit = load_thumbnails((DIR_DATA_RELATIVE + df_fit.filepath).to_list())
+    sites_fit = df_fit.site.to_numpy(dtype=str)
+    is_blank_fit = df_fit.blank.to_numpy().astype(bool)
+    valid = ~np.isnan(thumbnails_fit).any(axis=(1, 2))
+
+    prefilter = {"backgrounds": build_site_backgrounds(thumbnails_fit[valid], sites_fit[valid]), "target_recall": target_recall}
+    backgrounds_fit = np.stack([prefilter["backgrounds"][site] for site in sites_fit[valid]])
+
+    X_global = _global_features(thumbnails_fit[valid])
+    X_site = np.column_stack([X_global, _site_features(thumbnails_fit[valid], backgrounds_fit)])
+    prefilter["classifier_global"] = make_pipeline(StandardScaler(), LogisticRegression(max_iter=1000)).fit(X_global, is_blank_fit[valid])
+    prefilter["classifier_site"] = make_pipeline(StandardScaler(), LogisticRegression(max_iter=1000)).fit(X_site, is_blank_fit[valid])
+
+    # choose the thresholds on held-out frames. validation sites are not part of the fit data,
+    # so their backgrounds are built from the calibration frames themselves (as it would be done for a new site)
+    thumbnails_cal = load_thumbnails((DIR_DATA_RELATIVE + df_calibration.filepath).to_list())
+    sites_cal = df_calibration.site.to_numpy(dtype=str)
+    is_blank_cal = df_calibration.blank.to_numpy().astype(bool)
+    valid = ~np.isnan(thumbnails_cal).any(axis=(1, 2))
+    prefilter["backgrounds"].update(build_site_backgrounds(thumbnails_cal[valid], sites_cal[valid]))
+
+    p_blank_global = predict_blank_probabilities(prefilter, thumbnails_cal[valid])
+    p_blank_site = predict_blank_probabilities(prefilter, thumbnails_cal[valid], sites_cal[valid])
+    prefilter["threshold_global"] = _recall_threshold(p_blank_global, is_blank_cal[valid], target_recall)
+    prefilter["threshold_site"] = _recall_threshold(p_blank_site, is_blank_cal[valid], target_recall)
+
+    if filepath is not None:
+        save_blank_prefilter(prefilter, filepath)
+
+    return prefilter
+
+
+def save_blank_prefilter(prefilter: dict, filepath: str = FILEPATH_PREFILTER) -> None:
+    """Save a fitted prefilter.
+
+    Args:
+        prefilter (dict): the fitted prefilter.
+        filepath (str, optional): output file path. Defaults to FILEPATH_PREFILTER.
+
+    Returns:
+        None: None
+    """
+
+    with open(filepath, "wb") as file:
+        pickle.dump(prefilter, file)
+
+    return None
+
+
+def load_blank_prefilter(filepath: str = FILEPATH_PREFILTER) -> dict | None:
+    """Load a prefilter saved by fit_blank_prefilter.
+
+    Args:
+        filepath (str, optional): path of the prefilter file. Defaults to FILEPATH_PREFILTER.
+
+    Returns:
+        dict | None: the fitted prefilter (None if the file does not exist).
+    """
+
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath, "rb") as file:
+        return pickle.load(file)
+
+
+def predict_blank_probabilities(prefilter: dict, thumbnails: np.ndarray, sites: np.ndarray | None = None) -> np.ndarray:
+    """Return the probability of being a blank scene for each thumbnail.
+
+    Frames of sites with a background model are scored by the frame differencing classifier, all others by the site-independent one.
+
+    Args:
+        prefilter (dict): the fitted prefilter.
+        thumbnails (np.ndarray): the thumbnails of the frames.
+        sites (np.ndarray | None, optional): the site of every frame. Defaults to None (unknown sites).
+
+    Returns:
+        np.ndarray: the blank probabilities.
+    """
+
+    thumbnails = np.nan_to_num(thumbnails)  # unreadable frames are scored on a black thumbnail
+    X_global = _global_features(thumbnails)
+    p_blank = prefilter["classifier_global"].predict_proba(X_global)[:, 1]
+
+    if sites is not None:
+        sites = np.asarray(sites, dtype=str)
+        has_background = np.array([site in prefilter["backgrounds"] for site in sites], dtype=bool)
+        if has_background.any():
+            backgrounds = np.stack([prefilter["backgrounds"][site] for site in sites[has_background]])
+            X_site = np.column_stack([X_global[has_background], _site_features(thumbnails[has_background], backgrounds)])
+            p_blank[has_background] = prefilter["classifier_site"].predict_proba(X_site)[:, 1]
+
+    return p_blank
+
+
+def is_confidently_blank(prefilter: dict, thumbnails: np.ndarray, sites: np.ndarray | None = None) -> np.ndarray:
+    """Return a boolean mask of the frames that can skip the classifier because they are confidently blank.
+
+    Args:
+        prefilter (dict): the fitted prefilter.
+        thumbnails (np.ndarray): the thumbnails of the frames.
+        sites (np.ndarray | None, optional): the site of every frame. Defaults to None (unknown sites).
+
+    Returns:
+        np.ndarray: boolean mask (True: skip the classifier).
+    """
+
+    p_blank = predict_blank_probabilities(prefilter, thumbnails, sites)
+    thresholds = np.full(p_blank.shape, prefilter["threshold_global"])
+    if sites is not None:
+        has_background = np.array([site in prefilter["backgrounds"] for site in np.asarray(sites, dtype=str)], dtype=bool)
+        thresholds[has_background] = prefilter["threshold_site"]
+
+    # unreadable frames are never skipped
+    return (p_blank > thresholds) & ~np.isnan(thumbnails).any(axis=(1, 2))
+
+
+def predict_with_prefilter(model: tf.keras.Model,
+                           prefilter: dict,
+                           filepaths: list[str],
+                           sites: np.ndarray | None = None,
+                           image_size: tuple[int, int] = (224, 224),
+                           batch_size: int = 32,
+                           min_frames_background: int = 10) -> tuple[np.ndarray, dict]:
+    """Run batch inference, skipping the classifier for confidently blank frames (these get a one-hot blank prediction).
+
+    Sites without a background model get one built from their frames in this batch (if there are at least min_frames_background of them).
+
+    Args:
+        model (tf.keras.Model): the classifier.
+        prefilter (dict): the fitted prefilter.
+        filepaths (list[str]): list of image file paths.
+        sites (np.ndarray | None, optional): the site of every frame. Defaults to None (unknown sites).
+        image_size (tuple[int, int], optional): (height, width) of the model input. Defaults to (224, 224).
+        batch_size (int, optional): batch size used for inference. Defaults to 32.
+        min_frames_background (int, optional): Minimum number of frames for building the background model of a new site. Defaults to 10.
+
+    Returns:
+        tuple[np.ndarray, dict]: 2-tuple containing (the predicted class probabilities, a dictionary with timing statistics and the mask of skipped frames).
+    """
+
+    time_start = time.perf_counter()
+    thumbnails = load_thumbnails(filepaths)
+    if sites is not None:
+        sites = np.asarray(sites, dtype=str)
+        sites_new, counts = np.unique(sites[~np.isin(sites, list(prefilter["backgrounds"]))], return_counts=True)
+        sites_new = sites_new[counts >= min_frames_background]
+        if sites_new.size > 0:
+            in_new_site = np.isin(sites, sites_new)
+            backgrounds_new = build_site_backgrounds(thumbnails[in_new_site], sites[in_new_site])
+            prefilter = {**prefilter, "backgrounds": {**prefilter["backgrounds"], **backgrounds_new}}
+    skip = is_confidently_blank(prefilter, thumbnails, sites)
+    time_prefilter = time.perf_counter() - time_start
+
+    predictions = np.zeros((len(filepaths), len(LABEL_COLUMNS)), dtype=np.float32)
+    predictions[skip, IDX_BLANK] = 1.0
+
+    time_start = time.perf_counter()
+    filepaths_model = np.asarray(filepaths)[~skip]
+    if filepaths_model.size > 0:
+        dataset = (tf.data.Dataset.from_tensor_slices(filepaths_model)
+                   .map(lambda filepath: load_image_for_model(filepath, image_size), num_parallel_calls=tf.data.AUTOTUNE)
+                   .batch(batch_size)
+                   .prefetch(tf.data.AUTOTUNE))
+        predictions[~skip] = model.predict(dataset, verbose=0)
+    time_model = time.perf_counter() - time_start
+
+    # the time for running the model on all frames is extrapolated from the measured time per frame
+    n_model = int((~skip).sum())
+    time_model_all = time_model / n_model * len(filepaths) if n_model > 0 else np.nan
+    stats = {
+        "n_frames": len(filepaths),
+        "n_skipped": int(skip.sum()),
+        "fraction_skipped": float(skip.mean()) if len(filepaths) > 0 else 0.0,
+        "time_prefilter": time_prefilter,
+        "time_model": time_model,
+        "time_model_all_estimated": time_model_all,
+        "time_saved_estimated": time_model_all - time_model - time_prefilter,
+        "skipped": skip,
+    }
+
+    return predictions, stats
+
+
+def report_prefilter_savings(model: tf.keras.Model, prefilter: dict, split: str = "test", **kwargs) -> dict:
+    """Run prefiltered inference on a dataset split and report the skipped fraction, the recall of non-blank frames and the inference time saved.
+
+    Args:
+        model (tf.keras.Model): the classifier.
+        prefilter (dict): the fitted prefilter.
+        split (str, optional): the dataset split ("train", "val" or "test"). Defaults to "test".
+        **kwargs: further keyword arguments passed to predict_with_prefilter.
+
+    Returns:
+        dict: dictionary with the statistics.
+    """
+
+    df = load_metadata(split, columns=["filepath", "site"] + LABEL_COLUMNS)
+    predictions, stats = predict_with_prefilter(model, prefilter, (DIR_DATA_RELATIVE + df.filepath).to_list(), df.site.to_numpy(dtype=str), **kwargs)
+
+    is_blank = df.blank.to_numpy().astype(bool)
+    skipped = stats.pop("skipped")
+    stats["recall_non_blank"] = float(1.0 - skipped[~is_blank].mean()) if (~is_blank).any() else np.nan
+    stats["accuracy"] = float((predictions.argmax(axis=1) == df[LABEL_COLUMNS].to_numpy().argmax(axis=1)).mean())
+
+    print(f"Frames skipped by the prefilter: {stats['n_skipped']} of {stats['n_frames']} ({stats['fraction_skipped']*100:.1f}%)")
+    print(f"Recall of non-blank frames: {stats['recall_non_blank']:.4f} (target: {prefilter['target_recall']:.4f})")
+    print(f"Inference time: {stats['time_prefilter'] + stats['time_model']:.1f} s (estimated without prefilter: {stats['time_model_all_estimated']:.1f} s, saved: {stats['time_saved_estimated']:.1f} s)")
+
+    return stats
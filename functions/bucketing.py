@@ -0,0 +1,292 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+from metadata import DIR_DATA_RELATIVE, LABEL_COLUMNS, load_metadata
+from image_headers import read_jpeg_size, load_image_headers
+
+
+IMAGE_SIZE_MAX = (540, 960)  # (height, width) of the largest images in the data, used as padding target by the baseline pipeline
+
+
+def read_image_sizes(filepaths: list[str], n_jobs: int | None = None) -> pd.DataFrame:
+    """Read the image dimensions from the file headers (no pixel data is decoded).
+
+    Args:
+        filepaths (list[str]): list of image file paths.
+        n_jobs (int | None, optional): Number of threads reading headers. Defaults to None (ThreadPoolExecutor default).
+
+    Returns:
+        pd.DataFrame: DataFrame with the columns "height" and "width" (0 for unreadable files).
+    """
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        sizes = [size[:2] if size is not None else (0, 0) for size in executor.map(read_jpeg_size, filepaths)]
+
+    return pd.DataFrame(sizes, columns=["height", "width"], dtype=np.int32)
+
+
+def compute_padding_fraction(heights: np.ndarray, widths: np.ndarray, target_height: np.ndarray | int, target_width: np.ndarray | int) -> np.ndarray:
+    """Return the fraction of padding pixels per image after resizing (keeping the aspect ratio) and padding to a target size.
+
+    Args:
+        heights (np.ndarray): image heights.
+        widths (np.ndarray): image widths.
+        target_height (np.ndarray | int): target height(s).
+        target_width (np.ndarray | int): target width(s).
+
+    Returns:
+        np.ndarray: padding fraction per image.
+    """
+
+    heights = np.asarray(heights, dtype=np.float64)
+    widths = np.asarray(widths, dtype=np.float64)
+    scale = np.minimum(target_height / heights, target_width / widths)
+
+    return 1.0 - (heights * scale) * (widths * scale) / (np.asarray(target_height) * np.asarray(target_width))
+
+
+def compute_upscale_fraction(heights: np.ndarray, widths: np.ndarray, target_height: np.ndarray | int, target_width: np.ndarray | int) -> np.ndarray:
+    """Return the fraction of input pixels per image that are interpolated beyond the native resolution when the image is
+    resized (keeping the aspect ratio) to fit a target size (0 for images that are downscaled or kept at their size).
+
+    Args:
+        heights (np.ndarray): image heights.
+        widths (np.ndarray): image widths.
+        target_height (np.ndarray | int): target height(s).
+        target_width (np.ndarray | int): target width(s).
+
+    Returns:
+        np.ndarray: upscaled-pixel fraction per image (relative to the target size).
+    """
+
+    heights = np.asarray(heights, dtype=np.float64)
+    widths = np.asarray(widths, dtype=np.float64)
+    scale = np.minimum(target_height / heights, target_width / widths)
+
+    return np.maximum(0.0, scale**2 - 1.0) * heights * widths / (np.asarray(target_height) * np.asarray(target_width))
+
+
+def assign_buckets(heights: np.ndarray,
+                   widths: np.ndarray,
+                   aspect_ratio_tolerance: float = 0.05,
+                   size_tolerance: float = 0.1,
+                   image_size_max: tuple[int, int] = IMAGE_SIZE_MAX) -> pd.DataFrame:
+    """Group images into buckets of similar aspect ratio and resolution and determine the input size of each bucket.
+
+    Images larger than image_size_max are first scaled down to fit it (keeping the aspect ratio), as in the baseline pipeline.
+    Buckets are bins of width aspect_ratio_tolerance in log(aspect ratio) and of width size_tolerance in log(height).
+    The bucket size is the smallest height and width among its images, so images are only ever scaled down (by less
+    than about size_tolerance) and padded, never upsampled to the size of larger images.
+
+    Args:
+        heights (np.ndarray): image heights.
+        widths (np.ndarray): image widths.
+        aspect_ratio_tolerance (float, optional): bin width in log(width/height). Defaults to 0.05.
+        size_tolerance (float, optional): bin width in log(height). Defaults to 0.1.
+        image_size_max (tuple[int, int], optional): maximum (height, width) of a bucket. Defaults to IMAGE_SIZE_MAX.
+
+    Returns:
+        pd.DataFrame: DataFrame with the columns "bucket", "bucket_height", "bucket_width" and "padding_fraction" (one row per image).
+    """
+
+    heights = np.asarray(heights, dtype=np.float64)
+    widths = np.asarray(widths, dtype=np.float64)
+
+    # cap the image sizes, keeping their aspect ratio
+    scale = np.minimum(1.0, np.minimum(image_size_max[0] / heights, image_size_max[1] / widths))
+    heights_capped = heights * scale
+    widths_capped = widths * scale
+
+    df = pd.DataFrame({
+        "aspect_ratio_bin": np.round(np.log(widths / heights) / aspect_ratio_tolerance).astype(int),
+        "size_bin": np.floor(np.log(heights_capped) / size_tolerance).astype(int),
+        "height": heights_capped,
+        "width": widths_capped,
+    })
+    df["bucket"] = df.groupby(["aspect_ratio_bin", "size_bin"]).ngroup()
+    buckets = df.bucket.to_numpy()
+
+    # the smallest height and width within a bucket, so that no image is upsampled
+    bucket_sizes = np.floor(df.groupby("bucket")[["height", "width"]].min()).astype(np.int32)
+
+    df["bucket_height"] = bucket_sizes.height.to_numpy()[buckets]
+    df["bucket_width"] = bucket_sizes.width.to_numpy()[buckets]
+    df["padding_fraction"] = compute_padding_fraction(heights, widths, df.bucket_height.to_numpy(), df.bucket_width.to_numpy())
+
+    return df[["bucket", "bucket_height", "bucket_width", "padding_fraction"]]
+
+
+def load_image_for_model(filepath: tf.Tensor, image_size: tuple[int, int]) -> tf.Tensor:
+    """Decode an image file and pad/resize it like keras.utils.image_dataset_from_directory(pad_to_aspect_ratio=True)."""
+
+    img = tf.io.decode_jpeg(tf.io.read_file(filepath), channels=3)
+
+    return tf.image.resize_with_pad(img, image_size[0], image_size[1])
+
+
+def _load_and_resize_image(filepath: tf.Tensor, label: tf.Tensor, height: int, width: int) -> tuple[tf.Tensor, tf.Tensor]:
+    """Decode an image file and resize/pad it to the size of its bucket."""
+
+    return load_image_for_model(filepath, (height, width)), label
+
+
+def build_bucketed_dataset(filepaths: list[str],
+                           labels: np.ndarray,
+                           batch_size: int = 64,
+                           shuffle: bool = True,
+                           seed: int = 42,
+                           aspect_ratio_tolerance: float = 0.05,
+                           size_tolerance: float = 0.1,
+                           image_size_max: tuple[int, int] = IMAGE_SIZE_MAX,
+                           sizes: pd.DataFrame | None = None) -> tuple[tf.data.Dataset, pd.DataFrame]:
+    """Build a tf.data pipeline that batches images within aspect ratio buckets, as an alternative to padding every image
+    to 540x960 with keras.utils.image_dataset_from_directory(pad_to_aspect_ratio=True).
+
+    Batches of different buckets have different spatial sizes, so the model input has to be declared with shape (None, None, 3).
+    Images with unreadable headers are left out. Without shuffling (batch inference), the images are returned in the order given
+    by the column "position" of the returned bucket assignment.
+
+    Args:
+        filepaths (list[str]): list of image file paths.
+        labels (np.ndarray): the (one-hot-encoded) labels.
+        batch_size (int, optional): batch size. Defaults to 64.
+        shuffle (bool, optional): Boolean switch for shuffling the images within buckets and the order of the batches. Defaults to True.
+        seed (int, optional): random seed. Defaults to 42.
+        aspect_ratio_tolerance (float, optional): bin width in log(width/height). Defaults to 0.05.
+        size_tolerance (float, optional): bin width in log(height). Defaults to 0.1.
+        image_size_max (tuple[int, int], optional): maximum (height, width) of a bucket. Defaults to IMAGE_SIZE_MAX.
+        sizes (pd.DataFrame | None, optional): image sizes (columns "height" and "width"). Defaults to None, which reads them from the file headers.
+
+    Returns:
+        tuple[tf.data.Dataset, pd.DataFrame]: 2-tuple containing (the dataset, the bucket assignment of every image).
+    """
+
+    if sizes is None:
+        sizes = read_image_sizes(filepaths)
+    valid = ((sizes.height > 0) & (sizes.width > 0)).to_numpy()
+    if not valid.all():
+        print(f"{(~valid).sum()} images with unreadable headers are left out.")
+    filepaths = np.asarray(filepaths)[valid]
+    labels = np.asarray(labels, dtype=np.float32)[valid]
+    sizes = sizes[valid].reset_index(drop=True)
+
+    bucket_info = assign_buckets(sizes.height.to_numpy(), sizes.width.to_numpy(),
+                                 aspect_ratio_tolerance=aspect_ratio_tolerance, size_tolerance=size_tolerance,
+                                 image_size_max=image_size_max)
+    bucket_info.insert(0, "filepath", filepaths)
+    bucket_info["position"] = np.argsort(np.argsort(bucket_info.bucket.to_numpy(), kind="stable"), kind="stable")
+
+    # one dataset per bucket, batched within the bucket
+    datasets = []
+    n_batches = []
+    for bucket, df_bucket in bucket_info.groupby("bucket"):
+        indices = df_bucket.index.to_numpy()
+        height, width = int(df_bucket.bucket_height.iloc[0]), int(df_bucket.bucket_width.iloc[0])
+        dataset = tf.data.Dataset.from_tensor_slices((filepaths[indices], labels[indices]))
+        if shuffle:
+            dataset = dataset.shuffle(buffer_size=indices.shape[0], seed=seed, reshuffle_each_iteration=True)
+        dataset = (dataset
+                   .map(lambda filepath, label, height=height, width=width: _load_and_resize_image(filepath, label, height, width),
+                        num_parallel_calls=tf.data.AUTOTUNE)
+                   .batch(batch_size))
+        datasets.append(dataset)
+        n_batches.append(int(np.ceil(indices.shape[0] / batch_size)))
+
+    # interleave the buckets batch by batch (the choice sequence contains each bucket once per batch)
+    choices = np.repeat(np.arange(len(datasets), dtype=np.int64), n_batches)
+    choice_dataset = tf.data.Dataset.from_tensor_slices(choices)
+    if shuffle:
+        choice_dataset = choice_dataset.shuffle(buffer_size=choices.shape[0], seed=seed, reshuffle_each_iteration=True)
+    dataset = tf.data.Dataset.choose_from_datasets(datasets, choice_dataset).prefetch(tf.data.AUTOTUNE)
+
+    return dataset, bucket_info
+
+
+def load_bucketed_split(split: str, batch_size: int = 64, shuffle: bool = True, seed: int = 42, **kwargs) -> tuple[tf.data.Dataset, pd.DataFrame]:
+    """Build the bucketed input pipeline for a dataset split listed in the metadata store.
+
+    The image sizes are taken from the image header table (see image_headers.scan_image_headers), corrupt images are left out.
+
+    Args:
+        split (str): the dataset split ("train", "val" or "test").
+        batch_size (int, optional): batch size. Defaults to 64.
+        shuffle (bool, optional): Boolean switch for shuffling. Defaults to True.
+        seed (int, optional): random seed. Defaults to 42.
+        **kwargs: further keyword arguments passed to build_bucketed_dataset.
+
+    Returns:
+        tuple[tf.data.Dataset, pd.DataFrame]: 2-tuple containing (the dataset, the bucket assignment of every image).
+    """
+
+    df = load_metadata(split, columns=["filepath"] + LABEL_COLUMNS)
+
+    # corrupt (or unscanned) images get the size 0 and are left out by build_bucketed_dataset
+    df_headers = load_image_headers(columns=["filepath", "height", "width", "is_corrupt"])
+    df_headers.loc[df_headers.is_corrupt, ["height", "width"]] = 0
+    sizes = df[["filepath"]].merge(df_headers, on="filepath", how="left")[["height", "width"]].fillna(0).astype(np.int32)
+
+    return build_bucketed_dataset((DIR_DATA_RELATIVE + df.filepath).to_list(), df[LABEL_COLUMNS].to_numpy(),
+                                  batch_size=batch_size, shuffle=shuffle, seed=seed, sizes=sizes, **kwargs)
+
+
+def report_padding(bucket_info: pd.DataFrame, sizes: pd.DataFrame | None = None, image_size_max: tuple[int, int] = IMAGE_SIZE_MAX) -> dict:
+    """Report the padding and upscaling overhead of the bucketed pipeline compared with padding every image to image_size_max.
+
+    The upscaled-pixel fraction is the share of input pixels that are interpolated beyond the native resolution of the images,
+    i.e. compute spent on pixels that carry no additional information (like the padding).
+
+    Args:
+        bucket_info (pd.DataFrame): bucket assignment as returned by build_bucketed_dataset.
+        sizes (pd.DataFrame | None, optional): image sizes (columns "height" and "width") in the order of bucket_info. Defaults to None, which reads them from the file headers.
+        image_size_max (tuple[int, int], optional): (height, width) used by the baseline pipeline. Defaults to IMAGE_SIZE_MAX.
+
+    Returns:
+        dict: dictionary with the pixel-weighted padding and upscaled-pixel fractions and the number of input pixels of both pipelines.
+    """
+
+    if sizes is None:
+        sizes = read_image_sizes(bucket_info.filepath.to_list())
+    heights = sizes.height.to_numpy()
+    widths = sizes.width.to_numpy()
+    bucket_heights = bucket_info.bucket_height.to_numpy()
+    bucket_widths = bucket_info.bucket_width.to_numpy()
+
+    pixels_bucketed = (bucket_heights * bucket_widths).astype(np.float64)
+    pixels_baseline = float(image_size_max[0] * image_size_max[1]) * len(bucket_info)
+    padding_baseline = compute_padding_fraction(heights, widths, image_size_max[0], image_size_max[1])
+    upscale = compute_upscale_fraction(heights, widths, bucket_heights, bucket_widths)
+    upscale_baseline = compute_upscale_fraction(heights, widths, image_size_max[0], image_size_max[1])
+
+    report = {
+        "n_buckets": int(bucket_info.bucket.nunique()),
+        "padding_fraction": float((bucket_info.padding_fraction * pixels_bucketed).sum() / pixels_bucketed.sum()),
+        "padding_fraction_baseline": float(padding_baseline.mean()),
+        "upscaled_fraction": float((upscale * pixels_bucketed).sum() / pixels_bucketed.sum()),
+        "upscaled_fraction_baseline": float(upscale_baseline.mean()),
+        "input_pixels": float(pixels_bucketed.sum()),
+        "input_pixels_baseline": pixels_baseline,
+    }
+    print(f"Number of buckets: {report['n_buckets']}")
+    print(f"Padding fraction: {report['padding_fraction']:.4f} (baseline: {report['padding_fraction_baseline']:.4f})")
+    print(f"Upscaled-pixel fraction: {report['upscaled_fraction']:.4f} (baseline: {report['upscaled_fraction_baseline']:.4f})")
+    print(f"Input pixels per epoch: {report['input_pixels']:.3e} (baseline: {report['input_pixels_baseline']:.3e})")
+
+    return report
+
+
+class PaddingFractionLogger(tf.keras.callbacks.Callback):
+    """Add the padding fraction of the bucketed input pipeline to the logs at the end of every epoch
+    (place it before the MLflow logger in the callbacks list to get it logged to MLflow as well)."""
+
+    def __init__(self, bucket_info: pd.DataFrame):
+        super().__init__()
+        pixels = (bucket_info.bucket_height * bucket_info.bucket_width).to_numpy(dtype=np.float64)
+        self.padding_fraction = float((bucket_info.padding_fraction * pixels).sum() / pixels.sum())
+
+    def on_epoch_end(self, epoch, logs=None):
+        if logs is not None:
+            logs["padding_fraction"] = self.padding_fraction
+        print(f"Epoch {epoch + 1}: padding fraction {self.padding_fraction:.4f}")
@@ -4,6 +4,11 @@ import pandas as pd
 import cv2 as cv
 import os
 import glob
+from functools import lru_cache
+
+from metadata import LABEL_COLUMNS, load_metadata
+from deduplication import MAX_HAMMING_DISTANCE, limit_frames_per_burst
+from image_headers import drop_corrupt_images
 
 
 def get_label_name_from_filename(filename: str) -> str:
@@ -16,14 +21,25 @@ def get_label_name_from_filename(filename: str) -> str:
         str: the category label (name of the animal)
     """
 
-    df_info__all = pd.read_csv("../data/data_info__all.csv")  # DataFrame containing all file info (including the labels)
-
     ID = filename.rstrip(".jpg")    
-    label_str = df_info__all.query("id == @ID")["animal_label"].values[0]
+    label_str = _get_label_lookup()[ID]
 
     return label_str
 
 
+@lru_cache(maxsize=1)
+def _get_label_lookup() -> pd.Series:
+    """Return a Series mapping image ids to category labels, loaded once per process.
+
+    Returns:
+        pd.Series: the category labels (as str) indexed by image id
+    """
+
+    df_info__all = load_metadata("data_info", columns=["id", "animal_label"])  # DataFrame containing the labels of all files
+
+    return df_info__all.set_index("id")["animal_label"].astype(str)
+
+
 def import_image_files(n_images: int = 16488) -> list[np.ndarray]:
     """Return a list of numpy.ndarrays containing a given number of images from the training dataset.
 
@@ -62,19 +78,41 @@ def import_images_from_file_list(file_list: list[str]) -> list[np.ndarray]:
     return image_list
 
 
-def load_data():
+def load_data(deduplicate: bool = False,
+              max_frames_per_burst: int | None = None,
+              max_hamming_distance: int = MAX_HAMMING_DISTANCE,
+              skip_corrupt: bool = False):
     """Function for loading train, validation and test datasets.
 
+    Args:
+        deduplicate (bool, optional): Boolean switch for keeping only one frame of each burst of near-duplicate frames. Defaults to False.
+        max_frames_per_burst (int | None, optional): Maximum number of frames kept per burst of near-duplicates. Defaults to None (no limit).
+        max_hamming_distance (int, optional): Maximum Hamming distance between the perceptual hashes of two near-duplicate frames. Defaults to MAX_HAMMING_DISTANCE.
+        skip_corrupt (bool, optional): Boolean switch for leaving out missing or corrupt image files (according to the image header table). Defaults to False.
+
     Returns:
         tuple: 3-tuple containing (a list of) features and (one-hot-encoded) labels for train, validation and test data.
     """
 
-    dir_data_info_relative = "../data/dataset_infos/"  # the relative directory path to all data files
-
-    # load info DataFrames
-    df_train = pd.read_csv(dir_data_info_relative+f"train_dataset_info__100000_runs.csv")
-    df_val = pd.read_csv(dir_data_info_relative+f"val_dataset_info__100000_runs.csv")
-    df_test = pd.read_csv(dir_data_info_relative+f"test_dataset_info__100000_runs.csv")
+    # load info DataFrames (only the ids, sites, file paths and the one-hot-encoded labels are needed)
+    columns = ["id", "site", "filepath"] + LABEL_COLUMNS
+    df_train = load_metadata("train", columns=columns)
+    df_val = load_metadata("val", columns=columns)
+    df_test = load_metadata("test", columns=columns)
+
+    # drop missing or corrupt files, which cv.imread would silently return as None
+    if skip_corrupt:
+        df_train = drop_corrupt_images(df_train)
+        df_val = drop_corrupt_images(df_val)
+        df_test = drop_corrupt_images(df_test)
+
+    # drop near-duplicate frames of camera trap bursts
+    if deduplicate:
+        max_frames_per_burst = 1
+    if max_frames_per_burst is not None:
+        df_train = limit_frames_per_burst(df_train, max_frames_per_burst, max_distance=max_hamming_distance)
+        df_val = limit_frames_per_burst(df_val, max_frames_per_burst, max_distance=max_hamming_distance)
+        df_test = limit_frames_per_burst(df_test, max_frames_per_burst, max_distance=max_hamming_distance)
 
     ## load all info data (one numpy array per image). use the list from the DataFrame to get a matching order
     dir_data_relative = "../data/"  # the relative directory path to all data files
@@ -86,9 +124,9 @@ def load_data():
     X_val_list = import_images_from_file_list(file_list=filepaths_val)  # load all images
     X_test_list = import_images_from_file_list(file_list=filepaths_test)  # load all images
 
-    Y_train = df_train.iloc[:, 9:]
-    Y_val = df_val.iloc[:, 9:]
-    Y_test = df_test.iloc[:, 9:]
+    Y_train = df_train[LABEL_COLUMNS]
+    Y_val = df_val[LABEL_COLUMNS]
+    Y_test = df_test[LABEL_COLUMNS]
 
     return (X_train_list, Y_train), (X_val_list, Y_val), (X_test_list, Y_test)
 
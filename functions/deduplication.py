@@ -0,0 +1,296 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import cv2 as cv
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from metadata import DIR_DATA_RELATIVE, load_metadata
+
+
+FILEPATH_HASH_INDEX = DIR_DATA_RELATIVE + "dhash_index.npz"  # default location of the perceptual hash index
+MAX_HAMMING_DISTANCE = 6  # default maximum number of differing hash bits for two frames to count as near-duplicates
+
+# number of set bits for every possible byte value (used for vectorized popcounts of 64 bit hashes)
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def compute_dhash(filepath: str) -> np.uint64 | None:
+    """Compute the 64 bit difference hash (dHash) of an image, a perceptual hash that is robust to small changes between burst frames.
+
+    Args:
+        filepath (str): path of the image file.
+
+    Returns:
+        np.uint64 | None: the hash value (None if the image could not be read).
+    """
+
+    img = cv.imread(filepath, cv.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+
+    # compare neighbouring pixels of a 9x8 thumbnail, which gives 8x8 = 64 bits
+    img_small = cv.resize(img, (9, 8), interpolation=cv.INTER_AREA)
+    bits = img_small[:, 1:] > img_small[:, :-1]
+
+    return np.packbits(bits.flatten()).view(">u8")[0].astype(np.uint64)
+
+
+def build_hash_index(filepaths: list[str], n_jobs: int | None = None, chunksize: int = 64) -> tuple[np.ndarray, np.ndarray]:
+    """Compute the difference hashes of a list of images in parallel.
+
+    Args:
+        filepaths (list[str]): list of image file paths.
+        n_jobs (int | None, optional): Number of worker processes. Defaults to None, which uses all available cores.
+        chunksize (int, optional): Number of files handed to a worker process at once. Defaults to 64.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: 2-tuple containing (uint64 hashes, boolean validity mask (False for unreadable images)), in the order of filepaths.
+    """
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        hashes = list(executor.map(compute_dhash, filepaths, chunksize=chunksize))
+
+    valid = np.array([value is not None for value in hashes], dtype=bool)
+    hashes = np.array([value if value is not None else 0 for value in hashes], dtype=np.uint64)
+
+    return hashes, valid
+
+
+def save_hash_index(ids: list[str] | np.ndarray, hashes: np.ndarray, valid: np.ndarray, filepath: str = FILEPATH_HASH_INDEX) -> None:
+    """Save a hash index (image ids, their uint64 hashes and the validity mask) to a compressed npz file.
+
+    Args:
+        ids (list[str] | np.ndarray): the image ids.
+        hashes (np.ndarray): the uint64 hashes (one per id).
+        valid (np.ndarray): boolean mask of the valid hashes (False for unreadable images).
+        filepath (str, optional): output file path. Defaults to FILEPATH_HASH_INDEX.
+
+    Returns:
+        None: None
+    """
+
+    # write to a temporary file first, so concurrent readers never see a partially written index
+    filepath_tmp = f"{filepath}.{os.getpid()}.tmp"
+    with open(filepath_tmp, "wb") as file:
+        np.savez_compressed(file, ids=np.asarray(ids, dtype=str), hashes=np.asarray(hashes, dtype=np.uint64), valid=np.asarray(valid, dtype=bool))
+    os.replace(filepath_tmp, filepath)
+
+    return None
+
+
+def load_hash_index(filepath: str = FILEPATH_HASH_INDEX) -> tuple[np.ndarray, np.ndarray, np.ndarray | None]:
+    """Load a hash index saved by save_hash_index.
+
+    Args:
+        filepath (str, optional): path of the index file. Defaults to FILEPATH_HASH_INDEX.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray | None]: 3-tuple containing (image ids, uint64 hashes, validity mask).
+            The mask is None for indexes saved without one, which have to be rebuilt.
+    """
+
+    with np.load(filepath) as index:
+        return index["ids"], index["hashes"], index["valid"] if "valid" in index.files else None
+
+
+def build_and_save_hash_index(filepath: str = FILEPATH_HASH_INDEX, n_jobs: int | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compute the hash index for all training images listed in the metadata store and save it.
+
+    Args:
+        filepath (str, optional): output file path. Defaults to FILEPATH_HASH_INDEX.
+        n_jobs (int | None, optional): Number of worker processes. Defaults to None, which uses all available cores.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: 3-tuple containing (image ids, uint64 hashes, validity mask).
+    """
+
+    df = load_metadata("data_info", columns=["id", "filepath"])
+    ids = df.id.to_numpy(dtype=str)
+    hashes, valid = build_hash_index((DIR_DATA_RELATIVE + df.filepath).to_list(), n_jobs=n_jobs)
+    save_hash_index(ids, hashes, valid, filepath=filepath)
+
+    return ids, hashes, valid
+
+
+def extend_hash_index(ids_new: np.ndarray,
+                      filepaths_new: np.ndarray,
+                      filepath: str = FILEPATH_HASH_INDEX,
+                      n_jobs: int | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Add the hashes of images that are not yet in the (saved) hash index and save the extended index.
+
+    Args:
+        ids_new (np.ndarray): ids of the images to add (ids already in the index are skipped).
+        filepaths_new (np.ndarray): image file paths (relative to the data directory), aligned with ids_new.
+        filepath (str, optional): path of the index file. Defaults to FILEPATH_HASH_INDEX.
+        n_jobs (int | None, optional): Number of worker processes. Defaults to None, which uses all available cores.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: 3-tuple containing (image ids, uint64 hashes, validity mask) of the extended index.
+    """
+
+    ids, hashes, valid = load_hash_index(filepath)
+    if valid is None:
+        ids, hashes, valid = build_and_save_hash_index(filepath, n_jobs=n_jobs)
+    ids_new = np.asarray(ids_new, dtype=str)
+    mask = ~np.isin(ids_new, ids)
+    if mask.any():
+        hashes_new, valid_new = build_hash_index((DIR_DATA_RELATIVE + pd.Series(np.asarray(filepaths_new)[mask], dtype=str)).to_list(), n_jobs=n_jobs)
+        ids = np.concatenate([ids, ids_new[mask]])
+        hashes = np.concatenate([hashes, hashes_new])
+        valid = np.concatenate([valid, valid_new])
+        save_hash_index(ids, hashes, valid, filepath=filepath)
+
+    return ids, hashes, valid
+
+
+def hamming_distances(hashes_a: np.ndarray, hashes_b: np.ndarray | np.uint64) -> np.ndarray:
+    """Compute the (broadcasted) Hamming distances between two arrays of uint64 hashes.
+
+    Args:
+        hashes_a (np.ndarray): array of uint64 hashes.
+        hashes_b (np.ndarray | np.uint64): array of uint64 hashes (or a single hash) broadcastable against hashes_a.
+
+    Returns:
+        np.ndarray: array of dtype uint8 with the number of differing bits.
+    """
+
+    xor = np.ascontiguousarray(np.bitwise_xor(hashes_a, hashes_b), dtype=np.uint64)
+    bit_counts = _POPCOUNT_TABLE[xor.view(np.uint8)]
+
+    return bit_counts.reshape(*xor.shape, 8).sum(axis=-1, dtype=np.uint8)
+
+
+def query_neighbours(hashes: np.ndarray, query_hash: np.uint64, max_distance: int = MAX_HAMMING_DISTANCE) -> np.ndarray:
+    """Return the indices of all hashes within a given Hamming distance of a query hash.
+
+    Args:
+        hashes (np.ndarray): the uint64 hashes of the index.
+        query_hash (np.uint64): the hash to look up.
+        max_distance (int, optional): Maximum Hamming distance. Defaults to MAX_HAMMING_DISTANCE.
+
+    Returns:
+        np.ndarray: indices into hashes, sorted by increasing distance.
+    """
+
+    distances = hamming_distances(hashes, np.uint64(query_hash))
+    indices = np.flatnonzero(distances <= max_distance)
+
+    return indices[np.argsort(distances[indices], kind="stable")]
+
+
+def group_near_duplicates(hashes: np.ndarray,
+                          sites: np.ndarray | None = None,
+                          valid: np.ndarray | None = None,
+                          max_distance: int = MAX_HAMMING_DISTANCE,
+                          block_size: int = 2048) -> np.ndarray:
+    """Group near-duplicate frames (bursts) into connected components of the "Hamming distance <= max_distance" graph.
+
+    If sites are given, frames are only compared with frames from the same site, since bursts are taken by the same camera.
+    Frames without a valid hash (unreadable images) are never linked to other frames.
+
+    Args:
+        hashes (np.ndarray): the uint64 hashes.
+        sites (np.ndarray | None, optional): the site of every frame. Defaults to None, which compares all frames with each other.
+        valid (np.ndarray | None, optional): boolean mask of the valid hashes. Defaults to None (all hashes are valid).
+        max_distance (int, optional): Maximum Hamming distance for two frames to be linked. Defaults to MAX_HAMMING_DISTANCE.
+        block_size (int, optional): Number of rows of the pairwise distance matrix computed at once (bounds the memory use). Defaults to 2048.
+
+    Returns:
+        np.ndarray: integer burst id per frame (frames without near-duplicates get a burst of their own).
+    """
+
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    n = hashes.shape[0]
+    valid = np.ones(n, dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+    if sites is None:
+        groups = [np.arange(n)]
+    else:
+        _, site_codes = np.unique(np.asarray(sites, dtype=str), return_inverse=True)
+        order = np.argsort(site_codes, kind="stable")
+        groups = np.split(order, np.flatnonzero(np.diff(site_codes[order])) + 1)
+
+    # collect the edges of the near-duplicate graph blockwise within each group
+    rows, cols = [], []
+    for indices in groups:
+        hashes_group = hashes[indices]
+        for start in range(0, indices.shape[0], block_size):
+            distances = hamming_distances(hashes_group[start:start+block_size, None], hashes_group[None, :])
+            i, j = np.nonzero(distances <= max_distance)
+            keep = valid[indices[start + i]] & valid[indices[j]]
+            i, j = i[keep], j[keep]
+            rows.append(indices[start + i])
+            cols.append(indices[j])
+
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=int)
+    cols = np.concatenate(cols) if cols else np.empty(0, dtype=int)
+    graph = coo_matrix((np.ones(rows.shape[0], dtype=np.uint8), (rows, cols)), shape=(n, n))
+    _, burst_ids = connected_components(graph, directed=False)
+
+    return burst_ids
+
+
+def get_burst_ids(df: pd.DataFrame,
+                  filepath_index: str = FILEPATH_HASH_INDEX,
+                  max_distance: int = MAX_HAMMING_DISTANCE) -> pd.Series:
+    """Return the burst id of every frame in a DataFrame containing (at least) the columns "id" and "site".
+
+    Frames missing from an existing index are hashed and added to it (their file paths are taken from the "filepath" column
+    of df if present, otherwise from the metadata store).
+
+    Args:
+        df (pd.DataFrame): DataFrame with the image ids and sites (and optionally their file paths).
+        filepath_index (str, optional): path of the hash index file (built with build_and_save_hash_index if missing). Defaults to FILEPATH_HASH_INDEX.
+        max_distance (int, optional): Maximum Hamming distance for two frames to be linked. Defaults to MAX_HAMMING_DISTANCE.
+
+    Returns:
+        pd.Series: the burst ids (aligned with the index of df).
+    """
+
+    valid = None
+    if os.path.exists(filepath_index):
+        ids, hashes, valid = load_hash_index(filepath_index)
+    if valid is None:  # no index yet, or one saved without validity mask
+        ids, hashes, valid = build_and_save_hash_index(filepath_index)
+
+    # extend a stale index by the frames it does not contain yet
+    missing = ~df.id.astype(str).isin(ids).to_numpy()
+    if missing.any():
+        if "filepath" in df:
+            df_missing = df.loc[missing, ["id", "filepath"]]
+        else:
+            df_missing = load_metadata("data_info", columns=["id", "filepath"])
+            df_missing = df_missing[df_missing.id.isin(df.id[missing])]
+        ids, hashes, valid = extend_hash_index(df_missing.id.to_numpy(dtype=str), df_missing.filepath.to_numpy(dtype=str), filepath=filepath_index)
+
+    # align the hashes with the rows of df (ids unknown to the metadata store get no valid hash)
+    positions = pd.Series(np.arange(ids.shape[0]), index=ids).reindex(df.id.astype(str).to_numpy())
+    known = positions.notna().to_numpy()
+    positions = positions.fillna(0).to_numpy(dtype=np.int64)
+    burst_ids = group_near_duplicates(hashes[positions], sites=df.site.to_numpy(), valid=valid[positions] & known, max_distance=max_distance)
+
+    return pd.Series(burst_ids, index=df.index)
+
+
+def limit_frames_per_burst(df: pd.DataFrame,
+                           max_frames_per_burst: int = 1,
+                           filepath_index: str = FILEPATH_HASH_INDEX,
+                           max_distance: int = MAX_HAMMING_DISTANCE) -> pd.DataFrame:
+    """Keep at most a given number of frames of each burst of near-duplicates (max_frames_per_burst=1 deduplicates).
+
+    Args:
+        df (pd.DataFrame): DataFrame with (at least) the columns "id" and "site".
+        max_frames_per_burst (int, optional): Number of frames kept per burst (the first ones in the order of df). Defaults to 1.
+        filepath_index (str, optional): path of the hash index file. Defaults to FILEPATH_HASH_INDEX.
+        max_distance (int, optional): Maximum Hamming distance for two frames to be linked. Defaults to MAX_HAMMING_DISTANCE.
+
+    Returns:
+        pd.DataFrame: the filtered DataFrame.
+    """
+
+    burst_ids = get_burst_ids(df, filepath_index=filepath_index, max_distance=max_distance)
+    mask = burst_ids.groupby(burst_ids).cumcount() < max_frames_per_burst
+
+    return df[mask]
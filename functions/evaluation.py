@@ -0,0 +1,334 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+import mlflow
+import tensorflow as tf
+
+from metadata import DIR_DATA_RELATIVE, LABEL_COLUMNS, load_metadata
+from image_headers import drop_corrupt_images
+from prediction_cache import get_model_version
+from bucketing import load_image_for_model
+
+
+DIR_PREDICTIONS = DIR_DATA_RELATIVE + "predictions/"  # default location of the cached probability matrices
+
+
+def get_predictions_filepath(model_path: str,
+                             split: str,
+                             image_size: tuple[int, int] = (224, 224),
+                             dir_predictions: str = DIR_PREDICTIONS) -> str:
+    """Return the path of the cached predictions of a saved model on a dataset split (the path changes whenever the model file is replaced).
+
+    Args:
+        model_path (str): path of the saved model.
+        split (str): the dataset split ("train", "val" or "test").
+        image_size (tuple[int, int], optional): (height, width) of the model input. Defaults to (224, 224).
+        dir_predictions (str, optional): directory of the cached predictions. Defaults to DIR_PREDICTIONS.
+
+    Returns:
+        str: the path of the .npz file.
+    """
+
+    model_version = get_model_version(model_path).replace(":", "_")
+
+    return os.path.join(dir_predictions, f"{split}__{image_size[0]}x{image_size[1]}__{model_version}.npz")
+
+
+def predict_split(model: tf.keras.Model,
+                  split: str = "test",
+                  image_size: tuple[int, int] = (224, 224),
+                  batch_size: int = 32) -> dict[str, np.ndarray]:
+    """Run inference on all (readable) images of a dataset split.
+
+    Args:
+        model (tf.keras.Model): the classifier.
+        split (str, optional): the dataset split ("train", "val" or "test"). Defaults to "test".
+        image_size (tuple[int, int], optional): (height, width) of the model input. Defaults to (224, 224).
+        batch_size (int, optional): batch size used for inference. Defaults to 32.
+
+    Returns:
+        dict[str, np.ndarray]: dictionary with the arrays "ids", "sites", "y_true" (class indices) and "probabilities" (N x number of classes).
+    """
+
+    df = drop_corrupt_images(load_metadata(split, columns=["id", "site", "filepath"] + LABEL_COLUMNS))
+    dataset = (tf.data.Dataset.from_tensor_slices((DIR_DATA_RELATIVE + df.filepath).to_numpy())
+               .map(lambda filepath: load_image_for_model(filepath, image_size), num_parallel_calls=tf.data.AUTOTUNE)
+               .batch(batch_size)
+               .prefetch(tf.data.AUTOTUNE))
+
+    return {
+        "ids": df.id.to_numpy(dtype=str),
+        "sites": df.site.to_numpy(dtype=str),
+        "y_true": df[LABEL_COLUMNS].to_numpy().argmax(axis=1),
+        "probabilities": model.predict(dataset, verbose=0).astype(np.float32),
+    }
+
+
+def load_or_predict(model_path: str,
+                    split: str = "test",
+                    image_size: tuple[int, int] = (224, 224),
+                    dir_predictions: str = DIR_PREDICTIONS,
+                    force: bool = False,
+                    **kwargs) -> dict[str, np.ndarray]:
+    """Return the predictions of a saved model on a dataset split, running inference only if they are not cached yet.
+
+    The probability matrix is stored together with the ids, sites and true labels of the split, so all metrics can be
+    recomputed from the cache without loading the model.
+
+    Args:
+        model_path (str): path of the saved model.
+        split (str, optional): the dataset split ("train", "val" or "test"). Defaults to "test".
+        image_size (tuple[int, int], optional): (height, width) of the model input (part of the cache key). Defaults to (224, 224).
+        dir_predictions (str, optional): directory of the cached predictions. Defaults to DIR_PREDICTIONS.
+        force (bool, optional): Boolean switch for re-running inference even if cached predictions exist. Defaults to False.
+        **kwargs: further keyword arguments passed to predict_split.
+
+    Returns:
+        dict[str, np.ndarray]: dictionary with the arrays "ids", "sites", "y_true" and "probabilities".
+    """
+
+    filepath = get_predictions_filepath(model_path, split, image_size, dir_predictions)
+    if os.path.exists(filepath) and not force:
+        with np.load(filepath) as cached:
+            return {key: cached[key] for key in cached.files}
+
+    model = tf.keras.models.load_model(model_path)
+    predictions = predict_split(model, split, image_size=image_size, **kwargs)
+    os.makedirs(dir_predictions, exist_ok=True)
+    np.savez_compressed(filepath, **predictions)
+
+    return predictions
+
+
+def confusion_matrix(y_true: np.ndarray, y_pred: np.ndarray, n_classes: int = len(LABEL_COLUMNS)) -> np.ndarray:
+    """Compute the confusion matrix (rows: true class, columns: predicted class).
+
+    Args:
+        y_true (np.ndarray): the true class indices.
+        y_pred (np.ndarray): the predicted class indices.
+        n_classes (int, optional): number of classes. Defaults to len(LABEL_COLUMNS).
+
+    Returns:
+        np.ndarray: the n_classes x n_classes matrix of counts.
+    """
+
+    return np.bincount(y_true * n_classes + y_pred, minlength=n_classes**2).reshape(n_classes, n_classes)
+
+
+def top_k_accuracy(y_true: np.ndarray, probabilities: np.ndarray, k: int) -> float:
+    """Compute the fraction of samples whose true class is among the k most probable classes.
+
+    Args:
+        y_true (np.ndarray): the true class indices.
+        probabilities (np.ndarray): the predicted class probabilities.
+        k (int): number of considered classes.
+
+    Returns:
+        float: the top-k accuracy.
+    """
+
+    top_k = np.argpartition(-probabilities, kth=min(k, probabilities.shape[1]) - 1, axis=1)[:, :k]
+
+    return float((top_k == y_true[:, np.newaxis]).any(axis=1).mean())
+
+
+def calibration_bins(y_true: np.ndarray, probabilities: np.ndarray, n_bins: int = 15) -> pd.DataFrame:
+    """Bin the samples by the confidence of the predicted class and compare the mean confidence with the accuracy per bin.
+
+    Args:
+        y_true (np.ndarray): the true class indices.
+        probabilities (np.ndarray): the predicted class probabilities.
+        n_bins (int, optional): number of equally wide confidence bins in [0, 1]. Defaults to 15.
+
+    Returns:
+        pd.DataFrame: DataFrame with the columns "bin_lower", "bin_upper", "count", "confidence" and "accuracy" (one row per bin).
+    """
+
+    confidences = probabilities.max(axis=1)
+    correct = (probabilities.argmax(axis=1) == y_true).astype(np.float64)
+    bin_edges = np.linspace(0.0, 1.0, n_bins + 1)
+    bin_indices = np.clip(np.digitize(confidences, bin_edges[1:-1], right=True), 0, n_bins - 1)
+
+    counts = np.bincount(bin_indices, minlength=n_bins)
+    with np.errstate(invalid="ignore"):
+        confidence = np.bincount(bin_indices, weights=confidences, minlength=n_bins) / counts
+        accuracy = np.bincount(bin_indices, weights=correct, minlength=n_bins) / counts
+
+    return pd.DataFrame({"bin_lower": bin_edges[:-1], "bin_upper": bin_edges[1:], "count": counts, "confidence": confidence, "accuracy": accuracy})
+
+
+def compute_evaluation_report(predictions: dict[str, np.ndarray], k_values: list[int] = [1, 2, 3], n_bins: int = 15) -> dict:
+    """Compute all evaluation metrics from (cached) predictions.
+
+    Args:
+        predictions (dict[str, np.ndarray]): dictionary with the arrays "sites", "y_true" and "probabilities" (see load_or_predict).
+        k_values (list[int], optional): the k of the reported top-k accuracies. Defaults to [1, 2, 3].
+        n_bins (int, optional): number of confidence bins for the calibration metrics. Defaults to 15.
+
+    Returns:
+        dict: dictionary with the scalar "metrics" and the DataFrames "confusion_matrix", "per_class", "per_site" and "calibration".
+    """
+
+    y_true = predictions["y_true"].astype(np.int64)
+    probabilities = predictions["probabilities"]
+    sites = predictions["sites"]
+    n_classes = probabilities.shape[1]
+    y_pred = probabilities.argmax(axis=1)
+    correct = y_pred == y_true
+
+    cm = confusion_matrix(y_true, y_pred, n_classes)
+    support = cm.sum(axis=1)
+    n_predicted = cm.sum(axis=0)
+    true_positives = np.diag(cm)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        precision = true_positives / n_predicted
+        recall = true_positives / support
+        f1 = 2 * precision * recall / (precision + recall)
+    df_per_class = pd.DataFrame({"precision": precision, "recall": recall, "f1": f1, "support": support,
+                                 "mean_probability_true_class": np.bincount(y_true, weights=probabilities[np.arange(len(y_true)), y_true], minlength=n_classes) / np.maximum(support, 1)},
+                                index=pd.Index(LABEL_COLUMNS, name="class"))
+
+    site_names, site_indices = np.unique(sites, return_inverse=True)
+    n_per_site = np.bincount(site_indices)
+    df_per_site = pd.DataFrame({"n_images": n_per_site,
+                                "accuracy": np.bincount(site_indices, weights=correct.astype(np.float64)) / n_per_site,
+                                "n_classes": (np.bincount(site_indices * n_classes + y_true, minlength=len(site_names) * n_classes).reshape(-1, n_classes) > 0).sum(axis=1)},
+                               index=pd.Index(site_names, name="site")).sort_values("accuracy")
+
+    df_calibration = calibration_bins(y_true, probabilities, n_bins)
+    gaps = np.abs(df_calibration.accuracy - df_calibration.confidence).fillna(0.0).to_numpy()
+
+    metrics = {
+        "accuracy": float(correct.mean()),
+        "balanced_accuracy": float(np.nanmean(recall)),
+        "macro_f1": float(np.nanmean(f1)),
+        "log_loss": float(-np.log(np.clip(probabilities[np.arange(len(y_true)), y_true], 1e-7, 1.0)).mean()),
+        "expected_calibration_error": float((gaps * df_calibration["count"].to_numpy()).sum() / len(y_true)),
+        "maximum_calibration_error": float(gaps.max()),
+        "mean_site_accuracy": float(df_per_site.accuracy.mean()),
+    }
+    for k in k_values:
+        metrics[f"top_{k}_accuracy"] = top_k_accuracy(y_true, probabilities, k)
+
+    return {
+        "metrics": metrics,
+        "confusion_matrix": pd.DataFrame(cm, index=pd.Index(LABEL_COLUMNS, name="true"), columns=pd.Index(LABEL_COLUMNS, name="predicted")),
+        "per_class": df_per_class,
+        "per_site": df_per_site,
+        "calibration": df_calibration,
+    }
+
+
+def plot_evaluation_report(report: dict) -> tuple[plt.Figure, plt.Figure]:
+    """Plot the (row-normalized) confusion matrix and the reliability diagram of an evaluation report.
+
+    Args:
+        report (dict): the evaluation report (see compute_evaluation_report).
+
+    Returns:
+        tuple[plt.Figure, plt.Figure]: 2-tuple containing (confusion matrix figure, reliability diagram figure).
+    """
+
+    cm = report["confusion_matrix"].to_numpy()
+    cm_normalized = cm / np.maximum(cm.sum(axis=1, keepdims=True), 1)
+    fig_cm, ax = plt.subplots(figsize=(8, 7))
+    image = ax.imshow(cm_normalized, cmap="viridis", vmin=0.0, vmax=1.0)
+    for (i, j), count in np.ndenumerate(cm):
+        ax.text(j, i, count, ha="center", va="center", color="white" if cm_normalized[i, j] < 0.5 else "black", fontsize=8)
+    ax.set_xticks(range(len(LABEL_COLUMNS)), LABEL_COLUMNS, rotation=45, ha="right")
+    ax.set_yticks(range(len(LABEL_COLUMNS)), LABEL_COLUMNS)
+    ax.set_xlabel("predicted")
+    ax.set_ylabel("true")
+    fig_cm.colorbar(image, ax=ax, label="fraction of true class")
+    fig_cm.tight_layout()
+
+    df_calibration = report["calibration"]
+    fig_calibration, ax = plt.subplots(figsize=(6, 6))
+    ax.plot([0, 1], [0, 1], "--", color="gray", label="perfect calibration")
+    ax.bar(df_calibration.bin_lower, df_calibration.accuracy, width=df_calibration.bin_upper - df_calibration.bin_lower,
+           align="edge", alpha=0.7, edgecolor="black", label="accuracy")
+    ax.plot((df_calibration.bin_lower + df_calibration.bin_upper) / 2, df_calibration.confidence, "o", color="red", label="mean confidence")
+    ax.set_xlim(0, 1)
+    ax.set_ylim(0, 1)
+    ax.set_xlabel("confidence")
+    ax.set_ylabel("accuracy")
+    ax.set_title(f"ECE = {report['metrics']['expected_calibration_error']:.4f}")
+    ax.legend(loc="upper left")
+    fig_calibration.tight_layout()
+
+    return fig_cm, fig_calibration
+
+
+def log_evaluation_to_mlflow(report: dict, split: str = "test", predictions: dict[str, np.ndarray] | None = None) -> None:
+    """Log an evaluation report to the active MLflow run (or to a new run if none is active).
+
+    The scalar metrics are logged with the split as prefix, the tables and figures as artifacts in the directory "evaluation_{split}".
+
+    Args:
+        report (dict): the evaluation report (see compute_evaluation_report).
+        split (str, optional): the evaluated dataset split. Defaults to "test".
+        predictions (dict[str, np.ndarray] | None, optional): the predictions, which are logged as well if given. Defaults to None.
+
+    Returns:
+        None: None
+    """
+
+    artifact_path = f"evaluation_{split}"
+    active_run = mlflow.active_run()
+    if active_run is None:
+        mlflow.start_run()
+
+    try:
+        mlflow.log_metrics({f"{split}_{name}": value for name, value in report["metrics"].items()})
+        mlflow.log_dict(report["metrics"], f"{artifact_path}/metrics.json")
+
+        with tempfile.TemporaryDirectory() as dir_tmp:
+            for name in ["confusion_matrix", "per_class", "per_site", "calibration"]:
+                report[name].to_csv(os.path.join(dir_tmp, f"{name}.csv"), index=name != "calibration")
+            if predictions is not None:
+                np.savez_compressed(os.path.join(dir_tmp, "predictions.npz"), **predictions)
+            mlflow.log_artifacts(dir_tmp, artifact_path)
+
+        fig_cm, fig_calibration = plot_evaluation_report(report)
+        mlflow.log_figure(fig_cm, f"{artifact_path}/confusion_matrix.png")
+        mlflow.log_figure(fig_calibration, f"{artifact_path}/reliability_diagram.png")
+        plt.close(fig_cm)
+        plt.close(fig_calibration)
+    finally:
+        if active_run is None:
+            mlflow.end_run()
+
+    return None
+
+
+def evaluate_model(model_path: str,
+                   split: str = "test",
+                   log_to_mlflow: bool = True,
+                   print_status: bool = True,
+                   **kwargs) -> dict:
+    """Evaluate a saved model on a dataset split from cached predictions (inference runs only once per model file and split).
+
+    Args:
+        model_path (str): path of the saved model.
+        split (str, optional): the dataset split ("train", "val" or "test"). Defaults to "test".
+        log_to_mlflow (bool, optional): Boolean switch for logging the report to MLflow. Defaults to True.
+        print_status (bool, optional): Boolean switch for printing the scalar metrics. Defaults to True.
+        **kwargs: further keyword arguments passed to load_or_predict.
+
+    Returns:
+        dict: the evaluation report (see compute_evaluation_report).
+    """
+
+    predictions = load_or_predict(model_path, split, **kwargs)
+    report = compute_evaluation_report(predictions)
+    if log_to_mlflow:
+        log_evaluation_to_mlflow(report, split, predictions)
+
+    if print_status:
+        for name, value in report["metrics"].items():
+            print(f"{name}: {value:.4f}")
+
+    return report
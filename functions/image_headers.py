@@ -0,0 +1,263 @@
+import os
+import glob
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from metadata import DIR_DATA_RELATIVE
+
+
+FILEPATH_IMAGE_HEADERS = DIR_DATA_RELATIVE + "image_headers.parquet"  # default location of the image header table
+IMAGE_PATTERNS = ["train_features/*.jpg"]  # glob patterns (relative to the data directory) of the scanned images
+HEADER_PARSER_VERSION = 2  # rows scanned by an older version of read_jpeg_header are scanned again
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, ...), which carry the image dimensions
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# JPEG markers without a length field
+_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+# EXIF tags of the timestamps (DateTimeOriginal is preferred over DateTime) and of the pointer to the EXIF sub-IFD
+_EXIF_TAG_DATETIME = 0x0132
+_EXIF_TAG_DATETIME_ORIGINAL = 0x9003
+_EXIF_TAG_EXIF_IFD = 0x8769
+# number of bytes at the end of a file searched for the end-of-image marker (some cameras append data after it)
+_EOI_SEARCH_BYTES = 4096
+
+
+def _parse_exif_timestamp(exif: bytes) -> datetime | None:
+    """Return the capture timestamp stored in the TIFF structure of an EXIF (APP1) segment."""
+
+    if len(exif) < 8 or exif[:2] not in {b"II", b"MM"}:
+        return None
+    byte_order = "<" if exif[:2] == b"II" else ">"
+
+    def read_ifd(offset: int) -> dict[int, tuple[int, int, int]]:
+        # returns a dictionary mapping tags to (count, value, offset of the data)
+        if offset + 2 > len(exif):
+            return {}
+        n_entries = struct.unpack_from(byte_order + "H", exif, offset)[0]
+        entries = {}
+        for i in range(n_entries):
+            entry_offset = offset + 2 + 12 * i
+            if entry_offset + 12 > len(exif):
+                break
+            tag, _, count, value = struct.unpack_from(byte_order + "HHII", exif, entry_offset)
+            # data of up to 4 bytes is stored inline in the value field
+            entries[tag] = (count, value, value if count > 4 else entry_offset + 8)
+        return entries
+
+    def read_ascii(entry: tuple[int, int, int]) -> str:
+        count, _, offset = entry
+        return exif[offset:offset+count].split(b"\0", 1)[0].decode("ascii", errors="ignore")
+
+    ifd0 = read_ifd(struct.unpack_from(byte_order + "I", exif, 4)[0])
+    candidates = []
+    if _EXIF_TAG_EXIF_IFD in ifd0:
+        exif_ifd = read_ifd(ifd0[_EXIF_TAG_EXIF_IFD][1])  # the value of the pointer tag is the offset of the sub-IFD
+        if _EXIF_TAG_DATETIME_ORIGINAL in exif_ifd:
+            candidates.append(exif_ifd[_EXIF_TAG_DATETIME_ORIGINAL])
+    if _EXIF_TAG_DATETIME in ifd0:
+        candidates.append(ifd0[_EXIF_TAG_DATETIME])
+
+    for entry in candidates:
+        try:
+            return datetime.strptime(read_ascii(entry), "%Y:%m:%d %H:%M:%S")
+        except ValueError:
+            continue
+
+    return None
+
+
+def read_jpeg_header(filepath: str) -> dict:
+    """Read the dimensions, the EXIF timestamp and basic integrity information of a JPEG image without decoding any pixel data.
+
+    Only the header segments up to the frame header (plus the last few KB of the file) are read. A file is flagged as
+    corrupt if it does not start with a start-of-image marker, has no frame header, is truncated within the header or
+    has no end-of-image marker near its end (trailing data after the marker is allowed).
+
+    Args:
+        filepath (str): path of the JPEG file.
+
+    Returns:
+        dict: dictionary with the keys "height", "width", "n_channels", "timestamp" (None if not available) and "is_corrupt".
+    """
+
+    header = {"height": 0, "width": 0, "n_channels": 0, "timestamp": None, "is_corrupt": True}
+
+    try:
+        with open(filepath, "rb") as file:
+            if file.read(2) != b"\xff\xd8":  # start of image marker
+                return header
+
+            while True:
+                # markers may be preceded by any number of fill bytes 0xFF
+                byte = file.read(1)
+                while byte == b"\xff":
+                    byte = file.read(1)
+                if not byte:
+                    return header
+                marker = byte[0]
+
+                if marker in _STANDALONE_MARKERS:
+                    continue
+                if marker in {0xD9, 0xDA}:  # end of image / start of scan before any frame header
+                    return header
+
+                segment_length_bytes = file.read(2)
+                if len(segment_length_bytes) < 2:
+                    return header
+                segment_length = struct.unpack(">H", segment_length_bytes)[0]
+
+                if marker == 0xE1 and header["timestamp"] is None:  # APP1 segment, which holds the EXIF data
+                    segment = file.read(segment_length - 2)
+                    if segment.startswith(b"Exif\0\0"):
+                        try:
+                            header["timestamp"] = _parse_exif_timestamp(segment[6:])
+                        except struct.error:
+                            pass  # malformed EXIF data does not make the image unusable
+                    continue
+
+                if marker in _SOF_MARKERS:
+                    frame_header = file.read(6)
+                    if len(frame_header) < 6:
+                        return header
+                    _, header["height"], header["width"], header["n_channels"] = struct.unpack(">BHHB", frame_header)
+                    break
+
+                file.seek(segment_length - 2, 1)  # skip the rest of the segment
+
+            # truncated files lack the end of image marker
+            file_size = file.seek(0, os.SEEK_END)
+            file.seek(max(0, file_size - _EOI_SEARCH_BYTES))
+            header["is_corrupt"] = b"\xff\xd9" not in file.read() or header["height"] == 0 or header["width"] == 0
+    except OSError:
+        pass
+
+    return header
+
+
+def read_jpeg_size(filepath: str) -> tuple[int, int, int] | None:
+    """Read the dimensions of a JPEG image from its file header, without decoding any pixel data.
+
+    Args:
+        filepath (str): path of the JPEG file.
+
+    Returns:
+        tuple[int, int, int] | None: 3-tuple containing (height, width, number of channels), or None if no valid header was found.
+    """
+
+    header = read_jpeg_header(filepath)
+    if header["height"] == 0 or header["width"] == 0:
+        return None
+
+    return header["height"], header["width"], header["n_channels"]
+
+
+def scan_image_headers(dir_data: str = DIR_DATA_RELATIVE,
+                       patterns: list[str] = IMAGE_PATTERNS,
+                       filepath_table: str = FILEPATH_IMAGE_HEADERS,
+                       n_jobs: int | None = 16,
+                       print_status: bool = True) -> pd.DataFrame:
+    """Scan the headers of all images in the data tree in parallel and write the results to a Parquet table.
+
+    On re-runs, only files that are new, whose modification time or size changed or that were scanned by an older header parser are read again.
+
+    Args:
+        dir_data (str, optional): Directory containing the data files. Defaults to DIR_DATA_RELATIVE.
+        patterns (list[str], optional): glob patterns (relative to dir_data) of the images to scan. Defaults to IMAGE_PATTERNS.
+        filepath_table (str, optional): path of the Parquet table. Defaults to FILEPATH_IMAGE_HEADERS.
+        n_jobs (int | None, optional): Number of threads reading headers. Defaults to 16.
+        print_status (bool, optional): Boolean switch for printing status info messages. Defaults to True.
+
+    Returns:
+        pd.DataFrame: the table with the columns "filepath" (relative to dir_data, as in the metadata tables), "id", "file_size",
+            "mtime_ns", "height", "width", "n_channels", "timestamp" and "is_corrupt".
+    """
+
+    # list the files with their modification times and sizes (a stat call per file, no reads)
+    filepaths = sorted({os.path.relpath(filepath, dir_data).replace(os.sep, "/")
+                        for pattern in patterns for filepath in glob.glob(os.path.join(dir_data, pattern))})
+    stats = [os.stat(os.path.join(dir_data, filepath)) for filepath in filepaths]
+    df_files = pd.DataFrame({
+        "filepath": filepaths,
+        "file_size": np.array([stat.st_size for stat in stats], dtype=np.int64),
+        "mtime_ns": np.array([stat.st_mtime_ns for stat in stats], dtype=np.int64),
+    })
+
+    # reuse the rows of unchanged files, scan the others
+    columns_header = ["height", "width", "n_channels", "timestamp", "is_corrupt"]
+    df_keep = df_files.iloc[:0].reindex(columns=list(df_files.columns) + columns_header)
+    if os.path.exists(filepath_table):
+        df_old = pd.read_parquet(filepath_table)
+        if "parser_version" in df_old:  # tables written before the parser was versioned are scanned completely
+            df_old = df_old[df_old.parser_version == HEADER_PARSER_VERSION]
+            df_keep = df_files.merge(df_old[["filepath", "file_size", "mtime_ns"] + columns_header], on=["filepath", "file_size", "mtime_ns"], how="inner")
+    df_scan = df_files[~df_files.filepath.isin(df_keep.filepath)].reset_index(drop=True)
+
+    if print_status:
+        print(f"Scanning the headers of {len(df_scan)} new or changed files ({len(df_keep)} unchanged files are skipped) ...")
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        headers = list(executor.map(read_jpeg_header, [os.path.join(dir_data, filepath) for filepath in df_scan.filepath]))
+    df_scan = pd.concat([df_scan, pd.DataFrame(headers, columns=columns_header)], axis=1)
+
+    df_files = pd.concat([df_keep, df_scan], ignore_index=True).sort_values("filepath", ignore_index=True)
+    df_files["id"] = df_files.filepath.str.rsplit("/", n=1).str[-1].str.rsplit(".", n=1).str[0]
+    df_files = df_files.astype({"height": np.int16, "width": np.int16, "n_channels": np.int8, "is_corrupt": bool})
+    df_files["timestamp"] = pd.to_datetime(df_files["timestamp"])
+    df_files["parser_version"] = np.int8(HEADER_PARSER_VERSION)
+    df_files = df_files[["filepath", "id", "file_size", "mtime_ns"] + columns_header + ["parser_version"]]
+    df_files.to_parquet(filepath_table, index=False)
+
+    if print_status:
+        print(f"DONE ({df_files.is_corrupt.sum()} of {len(df_files)} files are flagged as corrupt)\n")
+
+    return df_files
+
+
+def load_image_headers(columns: list[str] | None = None,
+                       filepath_table: str = FILEPATH_IMAGE_HEADERS,
+                       update: bool = False,
+                       **kwargs) -> pd.DataFrame:
+    """Load the image header table, scanning the data tree if the table does not exist yet, was written by an older header parser (or if update is True).
+
+    Args:
+        columns (list[str] | None, optional): Columns to load. Defaults to None, which loads all columns.
+        filepath_table (str, optional): path of the Parquet table. Defaults to FILEPATH_IMAGE_HEADERS.
+        update (bool, optional): Boolean switch for (incrementally) re-scanning the data tree first. Defaults to False.
+        **kwargs: further keyword arguments passed to scan_image_headers.
+
+    Returns:
+        pd.DataFrame: the image header table.
+    """
+
+    if not update and os.path.exists(filepath_table):
+        df_headers = pd.read_parquet(filepath_table)
+        if "parser_version" in df_headers and (df_headers.parser_version == HEADER_PARSER_VERSION).all():
+            return df_headers if columns is None else df_headers[columns]
+
+    df_headers = scan_image_headers(filepath_table=filepath_table, **kwargs)
+
+    return df_headers if columns is None else df_headers[columns]
+
+
+def drop_corrupt_images(df: pd.DataFrame, print_status: bool = True, **kwargs) -> pd.DataFrame:
+    """Remove the rows of missing or corrupt image files from a metadata DataFrame with a "filepath" column.
+
+    Args:
+        df (pd.DataFrame): DataFrame with (at least) the column "filepath" (relative to the data directory).
+        print_status (bool, optional): Boolean switch for printing the number of removed rows. Defaults to True.
+        **kwargs: further keyword arguments passed to load_image_headers.
+
+    Returns:
+        pd.DataFrame: the filtered DataFrame.
+    """
+
+    df_headers = load_image_headers(columns=["filepath", "is_corrupt"], **kwargs)
+    valid_filepaths = df_headers.filepath[~df_headers.is_corrupt]
+    mask = df.filepath.isin(valid_filepaths).to_numpy()
+    if print_status and not mask.all():
+        print(f"{(~mask).sum()} missing or corrupt image files are left out.")
+
+    return df[mask]
@@ -0,0 +1,140 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+DIR_DATA_RELATIVE = "../data/"  # the relative directory path to all data files
+N_RUNS = 100000  # number of site distribution runs used for generating the dataset info files
+
+# names of the one-hot-encoded label columns (in the same order as the class directories and the model outputs)
+LABEL_COLUMNS = ["antelope_duiker", "bird", "blank", "civet_genet", "hog", "leopard", "monkey_prosimian", "rodent"]
+
+# CSV files (relative to the data directory) backing each metadata table
+METADATA_TABLES = {
+    "data_info": "data_info__all.csv",
+    "train_features": "train_features.csv",
+    "train_labels": "train_labels.csv",
+    "train": f"dataset_infos/train_dataset_info__{N_RUNS}_runs.csv",
+    "val": f"dataset_infos/val_dataset_info__{N_RUNS}_runs.csv",
+    "test": f"dataset_infos/test_dataset_info__{N_RUNS}_runs.csv",
+}
+
+
+def _convert_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert the columns of a freshly parsed metadata CSV into compact, typed columns.
+
+    Args:
+        df (pd.DataFrame): DataFrame as returned by pd.read_csv.
+
+    Returns:
+        pd.DataFrame: DataFrame with categorical site/label columns and integer one-hot and size columns.
+    """
+
+    for column in ["site", "shape"]:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+    if "animal_label" in df.columns:
+        df["animal_label"] = pd.Categorical(df["animal_label"], categories=LABEL_COLUMNS)
+    for column in ["height", "width"]:
+        if column in df.columns:
+            df[column] = df[column].astype(np.int16)
+    if "N_channels" in df.columns:
+        df["N_channels"] = df["N_channels"].astype(np.int8)
+    if "aspect_ratio" in df.columns:
+        df["aspect_ratio"] = df["aspect_ratio"].astype(np.float32)
+    for column in LABEL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype(np.uint8)
+
+    return df
+
+
+def get_metadata_filepaths(table: str, dir_data: str = DIR_DATA_RELATIVE) -> tuple[str, str]:
+    """Return the paths of the source CSV file and the Parquet file of a metadata table.
+
+    Args:
+        table (str): Name of the metadata table, one of the keys of METADATA_TABLES.
+        dir_data (str, optional): Directory containing the data files. Defaults to DIR_DATA_RELATIVE.
+
+    Returns:
+        tuple[str, str]: 2-tuple containing (CSV filepath, Parquet filepath).
+    """
+
+    if table not in METADATA_TABLES:
+        raise KeyError(f"Unknown metadata table '{table}'. Valid tables are: {list(METADATA_TABLES)}")
+
+    filepath_csv = os.path.join(dir_data, METADATA_TABLES[table])
+    filepath_parquet = os.path.splitext(filepath_csv)[0] + ".parquet"
+
+    return filepath_csv, filepath_parquet
+
+
+def convert_metadata_table(table: str, dir_data: str = DIR_DATA_RELATIVE, force: bool = False) -> str:
+    """Convert a metadata CSV file once into a typed Parquet file stored next to it.
+
+    The conversion is skipped if the Parquet file exists and is newer than the CSV file (unless force is True).
+
+    Args:
+        table (str): Name of the metadata table, one of the keys of METADATA_TABLES.
+        dir_data (str, optional): Directory containing the data files. Defaults to DIR_DATA_RELATIVE.
+        force (bool, optional): Boolean switch for converting even if an up-to-date Parquet file exists. Defaults to False.
+
+    Returns:
+        str: the path of the Parquet file.
+    """
+
+    filepath_csv, filepath_parquet = get_metadata_filepaths(table, dir_data=dir_data)
+
+    csv_exists = os.path.exists(filepath_csv)
+    parquet_exists = os.path.exists(filepath_parquet)
+    if not csv_exists and not parquet_exists:
+        raise FileNotFoundError(f"Neither '{filepath_csv}' nor '{filepath_parquet}' exists.")
+
+    # only (re-)convert if the parquet file is missing or older than its source
+    up_to_date = parquet_exists and (not csv_exists or os.path.getmtime(filepath_parquet) >= os.path.getmtime(filepath_csv))
+    if (force and csv_exists) or not up_to_date:
+        df = _convert_dtypes(pd.read_csv(filepath_csv))
+        # write to a temporary file first, so concurrent readers never see a partially written Parquet file
+        filepath_tmp = f"{filepath_parquet}.{os.getpid()}.tmp"
+        df.to_parquet(filepath_tmp, index=False)
+        os.replace(filepath_tmp, filepath_parquet)
+
+    return filepath_parquet
+
+
+def convert_all_metadata_tables(dir_data: str = DIR_DATA_RELATIVE, force: bool = False) -> None:
+    """Convert all metadata CSV files that exist in the data directory into Parquet files.
+
+    Args:
+        dir_data (str, optional): Directory containing the data files. Defaults to DIR_DATA_RELATIVE.
+        force (bool, optional): Boolean switch for converting even if up-to-date Parquet files exist. Defaults to False.
+
+    Returns:
+        None: None
+    """
+
+    for table in METADATA_TABLES:
+        filepath_csv, filepath_parquet = get_metadata_filepaths(table, dir_data=dir_data)
+        if os.path.exists(filepath_csv) or os.path.exists(filepath_parquet):
+            convert_metadata_table(table, dir_data=dir_data, force=force)
+
+    return None
+
+
+def load_metadata(table: str, columns: list[str] | None = None, dir_data: str = DIR_DATA_RELATIVE) -> pd.DataFrame:
+    """Load (a subset of the columns of) a metadata table from its Parquet file, converting it from CSV on first use.
+
+    Args:
+        table (str): Name of the metadata table, one of the keys of METADATA_TABLES
+            ("data_info", "train_features", "train_labels", "train", "val", "test").
+        columns (list[str] | None, optional): Columns to load. Defaults to None, which loads all columns.
+        dir_data (str, optional): Directory containing the data files. Defaults to DIR_DATA_RELATIVE.
+
+    Returns:
+        pd.DataFrame: the metadata table with categorical site/label columns and integer one-hot columns.
+    """
+
+    filepath_parquet = convert_metadata_table(table, dir_data=dir_data)
+
+    return pd.read_parquet(filepath_parquet, columns=columns)
@@ -1,5 +1,13 @@
 import subprocess
 import os
+import json
+import glob
+import pickle
+import hashlib
+import socket
+import tempfile
+import multiprocessing
+import numpy as np
 import mlflow
 import hyperopt
 import tensorflow as tf
@@ -8,6 +16,9 @@ import requests
 from typing import Callable
 
 
+DIR_HYPEROPT_TRIALS = "../mlflow/hyperopt_trials/"  # default location of the hyperopt trial checkpoints
+
+
 def _is_mlflow_server_running(tracking_url: str) -> bool:
     """Check if the MLflow server is running by sending a request to the tracking URL.
 
@@ -84,10 +95,348 @@ def start_mlflow_server(experiment_name: str = "", timeout: int = 60) -> None:
 
 
 class _MLflowLogger(tf.keras.callbacks.Callback):
+    def __init__(self, n_samples: int | None = None, log_to_mlflow: bool = True, run_id: str | None = None, tracking_uri: str | None = None):
+        super().__init__()
+        self.n_samples = n_samples  # number of training samples per epoch (over all workers), used for the throughput
+        self.log_to_mlflow = log_to_mlflow  # False on non-chief workers
+        # with a run id, the metrics are logged to that run through a client instead of to the active (fluent) run
+        self.run_id = run_id
+        self.client = mlflow.tracking.MlflowClient(tracking_uri) if run_id is not None else None
+        self.throughputs = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._time_epoch_begin = time.perf_counter()
+        self._time_train_end = None
+
+    def on_test_begin(self, logs=None):
+        # the validation at the end of an epoch does not count towards the training throughput
+        if getattr(self, "_time_train_end", 0) is None:
+            self._time_train_end = time.perf_counter()
+
     def on_epoch_end(self, epoch, logs=None):
         if logs is not None:
+            if self.n_samples is not None:
+                time_train_end = self._time_train_end if self._time_train_end is not None else time.perf_counter()
+                logs["throughput"] = self.n_samples / (time_train_end - self._time_epoch_begin)
+                self.throughputs.append(logs["throughput"])
             # Log all metrics at the end of an epoch
-            mlflow.log_metrics(logs, step=epoch)
+            if self.log_to_mlflow:
+                if self.client is not None:
+                    timestamp = int(time.time() * 1000)
+                    self.client.log_batch(self.run_id, metrics=[mlflow.entities.Metric(key, float(value), timestamp, epoch) for key, value in logs.items()])
+                else:
+                    mlflow.log_metrics(logs, step=epoch)
+
+    def mean_throughput(self) -> float:
+        # the first epoch includes graph tracing and is only used if there is no other epoch
+        throughputs = self.throughputs[1:] if len(self.throughputs) > 1 else self.throughputs
+        return float(np.mean(throughputs)) if throughputs else float("nan")
+
+
+def _get_free_ports(n_ports: int) -> list[int]:
+    """Return a list of currently unused local TCP ports.
+
+    Args:
+        n_ports (int): Number of ports.
+
+    Returns:
+        list[int]: the port numbers.
+    """
+
+    sockets = []
+    for _ in range(n_ports):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("localhost", 0))
+        sockets.append(sock)
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+
+    return ports
+
+
+def _make_worker_dataset(X: np.ndarray, y: np.ndarray, batch_size: int, n_workers: int, worker_index: int, shuffle: bool = True, seed: int = 42) -> tf.data.Dataset:
+    """Build the tf.data pipeline of one worker, containing a deterministic, disjoint shard of the data.
+
+    Args:
+        X (np.ndarray): the features.
+        y (np.ndarray): the labels.
+        batch_size (int): the global batch size (divided by the number of workers).
+        n_workers (int): the number of workers.
+        worker_index (int): the index of this worker.
+        shuffle (bool, optional): Boolean switch for shuffling. Defaults to True.
+        seed (int, optional): random seed. Defaults to 42.
+
+    Returns:
+        tf.data.Dataset: the batched dataset of this worker.
+    """
+
+    # every worker gets the same number of samples, so that all workers run the same number of steps
+    n_samples_per_worker = len(X) // n_workers
+    dataset = tf.data.Dataset.from_tensor_slices((X, y)).shard(n_workers, worker_index).take(n_samples_per_worker)
+    if shuffle:
+        dataset = dataset.shuffle(buffer_size=n_samples_per_worker, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(max(1, batch_size // n_workers)).prefetch(tf.data.AUTOTUNE)
+
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+
+    return dataset.with_options(options)
+
+
+def _multi_worker_main(worker_index: int,
+                       n_workers: int,
+                       ports: list[int],
+                       train_fn: Callable,
+                       search_params: dict,
+                       data: tuple,
+                       signature,
+                       tracking_uri: str,
+                       parent_run_id: str,
+                       dir_result: str) -> None:
+    """Entry point of a local training worker process (run under a MultiWorkerMirroredStrategy)."""
+
+    os.environ["TF_CONFIG"] = json.dumps({
+        "cluster": {"worker": [f"localhost:{port}" for port in ports]},
+        "task": {"type": "worker", "index": worker_index},
+    })
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    is_chief = worker_index == 0
+    X_train, y_train, X_valid, y_valid = data
+
+    # only the chief logs to the run of the parent process, through a client with an explicit run id. the run is not started
+    # here, since the fluent API ends its active run when the process exits, while the parent still uses it. fluent calls
+    # (and the model copies of the other workers) go to a throwaway directory
+    with tempfile.TemporaryDirectory() as dir_tmp:
+        mlflow.set_tracking_uri(f"file://{dir_tmp}")
+
+        mlflow_logger = _MLflowLogger(n_samples=len(X_train), log_to_mlflow=is_chief,
+                                      run_id=parent_run_id if is_chief else None, tracking_uri=tracking_uri)
+        components = {
+            "signature": signature,
+            "mlflow_logger": mlflow_logger,
+            "strategy": strategy,
+            "n_workers": n_workers,
+            "worker_index": worker_index,
+            "is_chief": is_chief,
+            "make_dataset": lambda X, y, batch_size, shuffle=True: _make_worker_dataset(X, y, batch_size, n_workers, worker_index, shuffle=shuffle),
+        }
+        result = train_fn(search_params, components, X_train, y_train, X_valid, y_valid)
+
+        # all workers have to take part in saving the model, but only the chief writes to the result directory
+        model_path = os.path.join(dir_result if is_chief else dir_tmp, "model.keras")
+        result["model"].save(model_path)
+        if is_chief:
+            with open(os.path.join(dir_result, "result.json"), "w") as file:
+                json.dump({key: value for key, value in result.items() if key != "model"} | {"throughput": mlflow_logger.mean_throughput()}, file, default=float)
+
+
+def _run_multi_worker_training(train_fn: Callable,
+                               search_params: dict,
+                               data: tuple,
+                               signature,
+                               n_workers: int) -> dict:
+    """Run one training with n_workers local worker processes and return the result of the chief (including the loaded model).
+
+    The four arrays in data are pickled into every spawned worker, once per call. For large image arrays this copy (and the
+    memory of n_workers copies) is significant, so data that does not fit n_workers times into memory should be exported to
+    TFRecord shards (see tfrecord_export.py) and read by train_fn with load_tfrecord_dataset instead.
+
+    Args:
+        train_fn (Callable): the training function (has to be importable by the spawned worker processes, i.e. defined in a module).
+        search_params (dict): the hyperparameters.
+        data (tuple): 4-tuple containing (X_train, y_train, X_valid, y_valid).
+        signature: the MLflow model signature.
+        n_workers (int): the number of worker processes.
+
+    Returns:
+        dict: the result of the chief worker, including the "model" and its "throughput".
+    """
+
+    ports = _get_free_ports(n_workers)
+    parent_run_id = mlflow.active_run().info.run_id
+    context = multiprocessing.get_context("spawn")  # forking a process with an initialized TensorFlow runtime is not safe
+
+    with tempfile.TemporaryDirectory() as dir_result:
+        processes = [context.Process(target=_multi_worker_main,
+                                     args=(worker_index, n_workers, ports, train_fn, search_params, data, signature,
+                                           mlflow.get_tracking_uri(), parent_run_id, dir_result))
+                     for worker_index in range(n_workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        failed = [worker_index for worker_index, process in enumerate(processes) if process.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"Training worker(s) {failed} exited with an error.")
+
+        with open(os.path.join(dir_result, "result.json")) as file:
+            result = json.load(file)
+        result["model"] = tf.keras.models.load_model(os.path.join(dir_result, "model.keras"))
+
+    return result
+
+
+def _run_single_worker_training(train_fn: Callable,
+                                search_params: dict,
+                                data: tuple,
+                                signature) -> dict:
+    """Run one training in the current process and return the result of train_fn (including its "throughput").
+
+    Args:
+        train_fn (Callable): the training function.
+        search_params (dict): the hyperparameters.
+        data (tuple): 4-tuple containing (X_train, y_train, X_valid, y_valid).
+        signature: the MLflow model signature.
+
+    Returns:
+        dict: the result of train_fn, including the "model" and its "throughput".
+    """
+
+    X_train, y_train, X_valid, y_valid = data
+    mlflow_logger = _MLflowLogger(n_samples=len(X_train))
+    components = {
+        "signature": signature,
+        "mlflow_logger": mlflow_logger,
+        "strategy": tf.distribute.get_strategy(),
+        "n_workers": 1,
+        "worker_index": 0,
+        "is_chief": True,
+        "make_dataset": lambda X, y, batch_size, shuffle=True: _make_worker_dataset(X, y, batch_size, 1, 0, shuffle=shuffle),
+    }
+    result = train_fn(search_params, components, X_train, y_train, X_valid, y_valid)
+    result["throughput"] = mlflow_logger.mean_throughput()
+
+    return result
+
+
+def _scaling_report(throughputs: list[dict]) -> dict:
+    """Summarize measured training throughputs (samples per second) per number of workers, including speed-up and parallel efficiency."""
+
+    per_worker_count = {}
+    for entry in throughputs:
+        per_worker_count.setdefault(entry["n_workers"], []).append(entry["throughput"])
+
+    worker_counts = sorted(per_worker_count)
+    mean_throughputs = {n_workers: float(np.nanmean(per_worker_count[n_workers])) for n_workers in worker_counts}
+    reference = mean_throughputs[worker_counts[0]] / worker_counts[0]  # throughput per worker of the smallest configuration
+
+    return {
+        "runs": throughputs,
+        "summary": [{"n_workers": n_workers,
+                     "throughput": mean_throughputs[n_workers],
+                     "speedup": mean_throughputs[n_workers] / reference,
+                     "efficiency": mean_throughputs[n_workers] / (reference * n_workers)}
+                    for n_workers in worker_counts],
+    }
+
+
+def _fingerprint_arrays(arrays: list[np.ndarray], n_rows_sampled: int = 256) -> str:
+    """Return a hash identifying a dataset, computed from the shapes, dtypes and an evenly spaced sample of rows of its arrays."""
+
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.asarray(array)
+        digest.update(f"{array.shape}{array.dtype}".encode())
+        if array.shape[0] > 0:
+            rows = np.linspace(0, array.shape[0] - 1, num=min(n_rows_sampled, array.shape[0]), dtype=np.int64)
+            digest.update(np.ascontiguousarray(array[rows]).tobytes())
+
+    return digest.hexdigest()
+
+
+def get_search_key(search_space: dict, data: tuple) -> str:
+    """Return the key identifying a hyperparameter search, i.e. the combination of a search space and a dataset.
+
+    Args:
+        search_space (dict): the hyperopt search space.
+        data (tuple): 4-tuple containing (X_train, y_train, X_valid, y_valid).
+
+    Returns:
+        str: the key (the first 16 characters of a SHA-256 hex digest).
+    """
+
+    digest = hashlib.sha256(str(hyperopt.pyll.as_apply(search_space)).encode())
+    digest.update(_fingerprint_arrays(list(data)).encode())
+
+    return digest.hexdigest()[:16]
+
+
+def _params_key(params: dict) -> str:
+    """Return a canonical string representation of evaluated hyperparameters (used for recognizing repeated evaluations)."""
+
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def save_trials_checkpoint(filepath: str, trials: hyperopt.Trials, run_id: str, n_warm_start_trials: int = 0, rng_state: dict | None = None) -> None:
+    """Pickle the trials of a hyperparameter search (without trained models) together with the id of its MLflow run, the number of warm-start trials
+    and the state of the random generator proposing the hyperparameters.
+
+    The file is replaced atomically, so an interruption never leaves a broken checkpoint behind.
+
+    Args:
+        filepath (str): path of the checkpoint file.
+        trials (hyperopt.Trials): the trials (their results must not contain models).
+        run_id (str): the id of the MLflow run of the search.
+        n_warm_start_trials (int, optional): Number of trials taken over from earlier searches (not counted towards n_evals). Defaults to 0.
+        rng_state (dict | None, optional): bit_generator.state of the random generator passed to hyperopt.fmin. Defaults to None.
+
+    Returns:
+        None: None
+    """
+
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    filepath_tmp = filepath + ".tmp"
+    with open(filepath_tmp, "wb") as file:
+        pickle.dump({"trials": trials, "run_id": run_id, "n_warm_start_trials": n_warm_start_trials, "rng_state": rng_state}, file)
+    os.replace(filepath_tmp, filepath)
+
+    return None
+
+
+def load_trials_checkpoint(filepath: str) -> dict:
+    """Load a checkpoint written by save_trials_checkpoint.
+
+    Args:
+        filepath (str): path of the checkpoint file.
+
+    Returns:
+        dict: dictionary with the keys "trials" (hyperopt.Trials), "run_id" (str), "n_warm_start_trials" (int) and "rng_state" (dict | None).
+    """
+
+    with open(filepath, "rb") as file:
+        return pickle.load(file)
+
+
+def _merge_trials(trials_list: list[hyperopt.Trials]) -> hyperopt.Trials:
+    """Combine the completed trials of earlier searches into a new Trials object (renumbered, without repeated hyperparameters)."""
+
+    merged = hyperopt.Trials()
+    docs = []
+    seen = set()
+    for trials in trials_list:
+        for trial in trials.trials:
+            if trial["state"] != hyperopt.JOB_STATE_DONE or trial["result"].get("status") != hyperopt.STATUS_OK:
+                continue
+            key = _params_key(trial["result"].get("params", trial["misc"]["vals"]))
+            if key in seen:
+                continue
+            seen.add(key)
+
+            tid = len(docs)
+            doc = pickle.loads(pickle.dumps(trial))  # deep copy
+            doc["tid"] = tid
+            doc["exp_key"] = None
+            doc["misc"]["tid"] = tid
+            doc["misc"]["idxs"] = {name: [tid] if values else [] for name, values in doc["misc"]["vals"].items()}
+            docs.append(doc)
+
+    merged.new_trial_ids(len(docs))  # reserves the ids 0 ... n-1, so new trials continue the numbering
+    merged.insert_trial_docs(docs)
+    merged.refresh()
+
+    return merged
 
 
 def mlflow_train_keras_model(train_fn: Callable,
@@ -97,9 +446,27 @@ def mlflow_train_keras_model(train_fn: Callable,
                              y_valid: np.ndarray,
                              search_space: dict,
                              n_evals: int,
-                             mlflow_tags: dict = {}) -> mlflow.entities.Run:
+                             mlflow_tags: dict = {},
+                             n_workers: int = 1,
+                             resume: bool = False,
+                             warm_start: bool = False,
+                             trials_dir: str = DIR_HYPEROPT_TRIALS,
+                             seed: int | None = None) -> mlflow.entities.Run:
     """fuction for training a Keras model including hyperparameter optimization with hyperopt. Launches a number of runs corresponding to n_evals and returns a handle to the run with the best performance.
 
+    With n_workers > 1, every model is trained data-parallel by n_workers local processes under a tf.distribute.MultiWorkerMirroredStrategy.
+    In that case train_fn has to be defined in an importable module (the worker processes are spawned), should build and compile the model
+    within components["strategy"].scope() and should train on the per-worker datasets built by components["make_dataset"](X, y, batch_size).
+    Only the chief worker logs to MLflow, through components["mlflow_logger"] (fluent mlflow calls within train_fn are not logged
+    to the search run by the worker processes). The training throughput of every model is logged as a scaling report (scaling_report.json).
+    The training and validation arrays are copied into every worker process for every evaluation (see _run_multi_worker_training).
+
+    The trials are checkpointed to trials_dir/<search key>/<run id>.pkl after every evaluation, where the search key identifies the
+    search space and the dataset. With resume=True, the most recent search with the same key is continued (in its MLflow run) until it
+    has n_evals trials of its own (trials it was warm-started from do not count). With warm_start=True, a new search starts from the trials of all earlier searches with the same key, so TPE
+    proposes hyperparameters based on their results. Hyperparameters that were already evaluated are never trained again. Trained
+    models are kept in memory only, so the logged model is the best one trained in the current call.
+
     Args:
         train_fn (Callable): Function containing the model architecture specification and compilation. See train_model_sample in the mlflow_playground.ipynb notebook for a usage example.
         X_train (np.ndarray): The training data features.
@@ -109,45 +476,147 @@ def mlflow_train_keras_model(train_fn: Callable,
         search_space (dict): Dictionary containing the hyperparemter search space used in hyperparamter optimization by hyperopt.
         n_evals (int): Number of hyperopt optimization runs to perform, i.e. how many models with different hyperparameters are trained.
         mlflow_tags (dict, optional): Dictionary containing tags displayed in the mlflow GUI. The tags are hierarchically ordered. Defaults to {}.
+        n_workers (int, optional): Number of local worker processes training each model. Defaults to 1 (training in the current process).
+        resume (bool, optional): Boolean switch for continuing the most recent search with the same search space and dataset. Defaults to False.
+        warm_start (bool, optional): Boolean switch for starting a new search from the trials of earlier searches with the same search space and dataset. Defaults to False.
+        trials_dir (str, optional): Directory of the trial checkpoints. Defaults to DIR_HYPEROPT_TRIALS.
+        seed (int | None, optional): random seed of the hyperparameter proposals (a resumed search continues its checkpointed random stream).
+            Defaults to None, which uses the environment variable HYPEROPT_FMIN_SEED if set (like hyperopt.fmin) and a random seed otherwise.
 
     Returns:
         mlflow.entities.Run: Handle to the run with the best performance.
     """
 
     signature = mlflow.models.infer_signature(X_train, y_train)
-    mlflow_logger = _MLflowLogger()
+    data = (X_train, y_train, X_valid, y_valid)
+    throughputs = []
+    models = {}  # models trained in this call, by trial id
 
-    components = {
-        "signature": signature,
-        "mlflow_logger": mlflow_logger,
-    }
+    search_key = get_search_key(search_space, data)
+    dir_search = os.path.join(trials_dir, search_key)
+    filepaths_checkpoints = sorted(glob.glob(os.path.join(dir_search, "*.pkl")), key=os.path.getmtime)
+
+    # one random generator for the whole search. fmin is called once per evaluation and would otherwise create a new one every time
+    if seed is None and os.environ.get("HYPEROPT_FMIN_SEED"):
+        seed = int(os.environ["HYPEROPT_FMIN_SEED"])
+    rstate = np.random.default_rng(seed)
+
+    run_id = None
+    trials = hyperopt.Trials()
+    n_warm_start_trials = 0
+    if resume and filepaths_checkpoints:
+        checkpoint = load_trials_checkpoint(filepaths_checkpoints[-1])
+        trials, run_id = checkpoint["trials"], checkpoint["run_id"]
+        n_warm_start_trials = checkpoint.get("n_warm_start_trials", 0)
+        if checkpoint.get("rng_state") is not None:
+            rstate.bit_generator.state = checkpoint["rng_state"]
+        print(f"Resuming the search of run {run_id} with {len(trials.trials) - n_warm_start_trials} of {n_evals} completed trials")
+    elif warm_start and filepaths_checkpoints:
+        trials = _merge_trials([load_trials_checkpoint(filepath)["trials"] for filepath in filepaths_checkpoints])
+        n_warm_start_trials = len(trials.trials)
+        print(f"Warm-starting the search from {n_warm_start_trials} earlier trials")
+    n_total = n_warm_start_trials + n_evals
 
     def _objective_function(search_params=search_space):
-        result = train_fn(
-            search_params,
-            components,
-            X_train,
-            y_train,
-            X_valid,
-            y_valid
-            )
+        # reuse the result of hyperparameters that were already evaluated
+        key = _params_key(search_params)
+        for trial in trials.trials:
+            if trial["state"] == hyperopt.JOB_STATE_DONE and _params_key(trial["result"].get("params")) == key:
+                return {name: value for name, value in trial["result"].items() if name != "model"} | {"reused": True}
+
+        if n_workers > 1:
+            result = _run_multi_worker_training(train_fn, search_params, data, signature, n_workers)
+        else:
+            result = _run_single_worker_training(train_fn, search_params, data, signature)
+        result["params"] = search_params
+        throughputs.append({"eval": len(throughputs), "n_workers": n_workers, "throughput": result["throughput"]})
         return result
     
-    with mlflow.start_run(tags=mlflow_tags) as run:
-        trials = hyperopt.Trials()
-        best = hyperopt.fmin(
-            fn=_objective_function,
-            space=search_space,
-            algo=hyperopt.tpe.suggest,
-            max_evals=n_evals,
-            trials=trials
-        )
-        
-        best_run = sorted(trials.results, key=lambda x: x["loss"])[0]
-        mlflow.log_params(best)
-        mlflow.log_metric("final_val_loss", best_run["loss"])
+    with mlflow.start_run(run_id=run_id, tags=mlflow_tags if run_id is None else None) as run:
+        filepath_checkpoint = os.path.join(dir_search, f"{run.info.run_id}.pkl")
+
+        # one evaluation per fmin call, so that the trials can be checkpointed in between
+        while len(trials.trials) < n_total:
+            hyperopt.fmin(
+                fn=_objective_function,
+                space=search_space,
+                algo=hyperopt.tpe.suggest,
+                max_evals=len(trials.trials) + 1,
+                trials=trials,
+                rstate=rstate,
+                show_progressbar=False
+            )
+            trial = trials.trials[-1]
+            model = trial["result"].pop("model", None)  # models are not pickled into the checkpoint
+            if model is not None:
+                models[trial["tid"]] = model
+            save_trials_checkpoint(filepath_checkpoint, trials, run.info.run_id, n_warm_start_trials, rstate.bit_generator.state)
+
+        best_trial = trials.best_trial
+        best = trials.argmin
+        mlflow.log_dict({"params": best_trial["result"].get("params"), "hyperopt_vals": best, "loss": best_trial["result"]["loss"]}, "best_params.json")
+        if run_id is None:  # parameters of a resumed run cannot be overwritten
+            mlflow.log_params(best)
+            mlflow.log_params({"n_workers": n_workers, "hyperopt_search_key": search_key, "n_warm_start_trials": n_warm_start_trials})
+        mlflow.log_metric("final_val_loss", best_trial["result"]["loss"])
+        if throughputs:
+            mlflow.log_dict(_scaling_report(throughputs), "scaling_report.json")
         if len(mlflow_tags) > 0:
             mlflow.set_tags(mlflow_tags)
-        mlflow.tensorflow.log_model(best_run["model"], "model", signature=signature)
 
-    return run
\ No newline at end of file
+        if models:
+            losses = {trial["tid"]: trial["result"]["loss"] for trial in trials.trials if trial["tid"] in models}
+            best_tid = min(losses, key=losses.get)
+            if best_tid != best_trial["tid"]:
+                print(f"The best trial (loss {best_trial['result']['loss']:.4f}) was trained in an earlier search, logging the best model of this search instead")
+                mlflow.set_tag("best_trial_from_earlier_search", True)
+            mlflow.tensorflow.log_model(models[best_tid], "model", signature=signature)
+        else:
+            print("No model was trained in this call (all trials were completed or reused), so no model is logged")
+
+    return run
+
+
+def mlflow_benchmark_worker_scaling(train_fn: Callable,
+                                   X_train: np.ndarray,
+                                   y_train: np.ndarray,
+                                   X_valid: np.ndarray,
+                                   y_valid: np.ndarray,
+                                   search_params: dict,
+                                   worker_counts: list[int] = [1, 2, 4],
+                                   mlflow_tags: dict = {}) -> mlflow.entities.Run:
+    """Train the same model (fixed hyperparameters) with different numbers of local worker processes and log the throughput versus worker count.
+
+    Args:
+        train_fn (Callable): Function containing the model architecture specification and compilation (see mlflow_train_keras_model).
+        X_train (np.ndarray): The training data features.
+        y_train (np.ndarray): The training data labels.
+        X_valid (np.ndarray): The validation data features.
+        y_valid (np.ndarray): The validation data labels.
+        search_params (dict): The hyperparameters passed to train_fn.
+        worker_counts (list[int], optional): Numbers of worker processes to benchmark. Defaults to [1, 2, 4].
+        mlflow_tags (dict, optional): Dictionary containing tags displayed in the mlflow GUI. Defaults to {}.
+
+    Returns:
+        mlflow.entities.Run: Handle to the benchmark run (the report is logged as scaling_report.json).
+    """
+
+    signature = mlflow.models.infer_signature(X_train, y_train)
+    data = (X_train, y_train, X_valid, y_valid)
+    throughputs = []
+
+    with mlflow.start_run(tags=mlflow_tags) as run:
+        for n_workers in worker_counts:
+            if n_workers > 1:
+                result = _run_multi_worker_training(train_fn, search_params, data, signature, n_workers)
+            else:
+                result = _run_single_worker_training(train_fn, search_params, data, signature)
+            throughputs.append({"eval": len(throughputs), "n_workers": n_workers, "throughput": result["throughput"]})
+            mlflow.log_metric("throughput", result["throughput"], step=n_workers)
+
+        report = _scaling_report(throughputs)
+        mlflow.log_dict(report, "scaling_report.json")
+        for entry in report["summary"]:
+            print(f"{entry['n_workers']:3d} worker(s): {entry['throughput']:10.1f} samples/s (speed-up {entry['speedup']:5.2f}, efficiency {entry['efficiency']:5.2f})")
+
+    return run
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+
+
+def get_model_version(filepath: str) -> str:
+    """Return a version string for a saved model, which changes whenever the model file is replaced.
+
+    Args:
+        filepath (str): path of the saved model.
+
+    Returns:
+        str: the version string (file name, size and modification time).
+    """
+
+    stat = os.stat(filepath)
+
+    return f"{os.path.basename(filepath)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class PredictionCache:
+    """Bounded, thread-safe LRU cache for model predictions keyed by a hash of the image bytes and the model version.
+
+    A single instance is meant to be shared by all sessions of the app (e.g. via st.cache_resource). Optionally,
+    entries are also persisted in a local SQLite file, such that they survive restarts of the app.
+    """
+
+    def __init__(self, max_entries: int = 1024, filepath_sqlite: str | None = None, max_entries_sqlite: int = 100000):
+        """
+        Args:
+            max_entries (int, optional): Maximum number of entries kept in memory. Defaults to 1024.
+            filepath_sqlite (str | None, optional): path of the SQLite file for persisting entries. Defaults to None (no persistence).
+            max_entries_sqlite (int, optional): Maximum number of entries kept in the SQLite file. Defaults to 100000.
+        """
+
+        self.max_entries = max_entries
+        self.max_entries_sqlite = max_entries_sqlite
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._n_hits = 0
+        self._n_hits_sqlite = 0
+        self._n_misses = 0
+        self._n_inserts_sqlite = 0
+
+        self._connection = None
+        if filepath_sqlite is not None:
+            self._connection = sqlite3.connect(filepath_sqlite, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS predictions (
+                                            key TEXT PRIMARY KEY,
+                                            predictions BLOB NOT NULL,
+                                            accessed REAL NOT NULL)""")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS idx_predictions_accessed ON predictions (accessed)")
+            self._connection.commit()
+
+    @staticmethod
+    def make_key(image_bytes: bytes, model_version: str) -> str:
+        """Return the cache key of an image for a given model version.
+
+        Args:
+            image_bytes (bytes): the raw bytes of the uploaded image file.
+            model_version (str): the model version (see get_model_version).
+
+        Returns:
+            str: the cache key (SHA-256 hex digest).
+        """
+
+        digest = hashlib.sha256(model_version.encode())
+        digest.update(b"\0")
+        digest.update(image_bytes)
+
+        return digest.hexdigest()
+
+    def get(self, key: str) -> np.ndarray | None:
+        """Return the cached predictions for a key (None if not cached).
+
+        Args:
+            key (str): the cache key.
+
+        Returns:
+            np.ndarray | None: the cached predictions.
+        """
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._n_hits += 1
+                return self._entries[key].copy()
+
+            if self._connection is not None:
+                row = self._connection.execute("SELECT predictions FROM predictions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    predictions = np.frombuffer(row[0], dtype=np.float32)
+                    self._connection.execute("UPDATE predictions SET accessed = ? WHERE key = ?", (time.time(), key))
+                    self._connection.commit()
+                    self._insert_memory(key, predictions)
+                    self._n_hits += 1
+                    self._n_hits_sqlite += 1
+                    return predictions.copy()
+
+            self._n_misses += 1
+            return None
+
+    def put(self, key: str, predictions: np.ndarray) -> None:
+        """Store the predictions for a key.
+
+        Args:
+            key (str): the cache key.
+            predictions (np.ndarray): the predicted class probabilities (stored flattened as float32).
+
+        Returns:
+            None: None
+        """
+
+        predictions = np.asarray(predictions, dtype=np.float32).ravel()
+        with self._lock:
+            self._insert_memory(key, predictions)
+            if self._connection is not None:
+                self._connection.execute("INSERT OR REPLACE INTO predictions (key, predictions, accessed) VALUES (?, ?, ?)",
+                                         (key, predictions.tobytes(), time.time()))
+                self._n_inserts_sqlite += 1
+                # evict the least recently used entries from time to time
+                if self._n_inserts_sqlite % 100 == 0:
+                    self._connection.execute("""DELETE FROM predictions WHERE key NOT IN
+                                                (SELECT key FROM predictions ORDER BY accessed DESC LIMIT ?)""", (self.max_entries_sqlite,))
+                self._connection.commit()
+
+        return None
+
+    def _insert_memory(self, key: str, predictions: np.ndarray) -> None:
+        """Insert an entry into the in-memory LRU dictionary (the lock must be held)."""
+
+        self._entries[key] = predictions
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_predict(self, image_bytes: bytes, model_version: str, predict_fn: Callable) -> tuple[np.ndarray, bool]:
+        """Return the cached predictions for an image or compute and cache them.
+
+        Args:
+            image_bytes (bytes): the raw bytes of the uploaded image file.
+            model_version (str): the model version (see get_model_version).
+            predict_fn (Callable): function without arguments returning the predictions (only called on a cache miss).
+
+        Returns:
+            tuple[np.ndarray, bool]: 2-tuple containing (the predictions, True if they were served from the cache).
+        """
+
+        key = self.make_key(image_bytes, model_version)
+        predictions = self.get(key)
+        if predictions is not None:
+            return predictions, True
+
+        predictions = np.asarray(predict_fn(), dtype=np.float32).ravel()
+        self.put(key, predictions)
+
+        return predictions, False
+
+    def stats(self) -> dict:
+        """Return the hit-rate statistics of the cache.
+
+        Returns:
+            dict: dictionary with the number of hits (in total and served from SQLite), misses, the hit rate and the number of entries in memory.
+        """
+
+        with self._lock:
+            n_requests = self._n_hits + self._n_misses
+            return {
+                "hits": self._n_hits,
+                "hits_sqlite": self._n_hits_sqlite,
+                "misses": self._n_misses,
+                "hit_rate": self._n_hits / n_requests if n_requests > 0 else 0.0,
+                "entries": len(self._entries),
+            }
@@ -2,7 +2,10 @@ import shutil
 from pathlib import Path
 
 import numpy as np
-import pandas as pd
+
+from metadata import load_metadata
+from deduplication import MAX_HAMMING_DISTANCE, limit_frames_per_burst
+from image_headers import drop_corrupt_images
 
 
 def copy_files_to_directories(input_filepaths: list[str], output_directories: list[str]) -> None:
@@ -32,6 +35,10 @@ def build_dataset_directories_with_categories(fraction_train:float|int = 1.0,
                                               fraction_val:float|int = 1.0,
                                               fraction_test:float|int = 1.0,
                                               seed:int = 42,
+                                              deduplicate:bool = False,
+                                              max_frames_per_burst:int|None = None,
+                                              max_hamming_distance:int = MAX_HAMMING_DISTANCE,
+                                              skip_corrupt:bool = False,
                                               ask_for_choice_confirmation:bool = True,
                                               test_run:bool = True,
                                               print_status:bool = True,) -> None:
@@ -42,6 +49,10 @@ def build_dataset_directories_with_categories(fraction_train:float|int = 1.0,
         fraction_val (float | int, optional): Fraction of training validation that is sampled. Defaults to 1.0.
         fraction_test (float | int, optional): Fraction of training test that is sampled. Defaults to 1.0.
         seed (int, optional): _description_. Defaults to 42.
+        deduplicate (bool, optional): Boolean switch for keeping only one frame of each burst of near-duplicate frames. Defaults to False.
+        max_frames_per_burst (int | None, optional): Maximum number of frames kept per burst of near-duplicates. Defaults to None (no limit).
+        max_hamming_distance (int, optional): Maximum Hamming distance between the perceptual hashes of two near-duplicate frames. Defaults to MAX_HAMMING_DISTANCE.
+        skip_corrupt (bool, optional): Boolean switch for leaving out missing or corrupt image files (according to the image header table). Defaults to False.
         ask_for_choice_confirmation (bool, optional): Boolean switch for asking the user to continue in case of a chosen fraction <1. Defaults to True.
         test_run (bool, optional): Boolean switch for the execution of a test run -- data selection is performed but no files are actually copied. Defaults to True.
         print_status (bool, optional): Boolean switch for printing status info messages. Defaults to True.
@@ -51,12 +62,28 @@ def build_dataset_directories_with_categories(fraction_train:float|int = 1.0,
     """
 
     dir_data_parent_relative = "../data/"  # the relative directory path to all data files
-    dir_data_info_relative = "../data/dataset_infos/"  # the relative directory path to all data files
 
-    # load info DataFrames
-    df_train = pd.read_csv(dir_data_info_relative+f"train_dataset_info__100000_runs.csv")
-    df_val = pd.read_csv(dir_data_info_relative+f"val_dataset_info__100000_runs.csv")
-    df_test = pd.read_csv(dir_data_info_relative+f"test_dataset_info__100000_runs.csv")
+    # load info DataFrames (only the ids, sites, file paths and the labels are needed)
+    columns = ["id", "site", "filepath", "animal_label"]
+    df_train = load_metadata("train", columns=columns)
+    df_val = load_metadata("val", columns=columns)
+    df_test = load_metadata("test", columns=columns)
+
+    # drop missing or corrupt files, which would otherwise make the copying fail
+    if skip_corrupt:
+        df_train = drop_corrupt_images(df_train, print_status=print_status)
+        df_val = drop_corrupt_images(df_val, print_status=print_status)
+        df_test = drop_corrupt_images(df_test, print_status=print_status)
+
+    # drop near-duplicate frames of camera trap bursts (before sampling, such that fractions refer to the reduced data)
+    if deduplicate:
+        max_frames_per_burst = 1
+    if max_frames_per_burst is not None:
+        df_train = limit_frames_per_burst(df_train, max_frames_per_burst, max_distance=max_hamming_distance)
+        df_val = limit_frames_per_burst(df_val, max_frames_per_burst, max_distance=max_hamming_distance)
+        df_test = limit_frames_per_burst(df_test, max_frames_per_burst, max_distance=max_hamming_distance)
+        if print_status:
+            print(f"Number of data instances kept with at most {max_frames_per_burst} frame(s) per burst: {df_train.shape[0]} (train), {df_val.shape[0]} (validation), {df_test.shape[0]} (test)\n")
 
     # sample the data
     if not (0<=fraction_train<=1) or not (0<=fraction_val<=1) or not (0<=fraction_test<=1):
@@ -98,9 +125,9 @@ def build_dataset_directories_with_categories(fraction_train:float|int = 1.0,
     filepaths_all = np.concatenate([filepaths_train, filepaths_val, filepaths_test])  # list with all image file paths
 
     # get the labels
-    labels_train = df_train.animal_label.to_list()
-    labels_val = df_val.animal_label.to_list()
-    labels_test = df_test.animal_label.to_list()
+    labels_train = df_train.animal_label.astype(str).to_list()
+    labels_val = df_val.animal_label.astype(str).to_list()
+    labels_test = df_test.animal_label.astype(str).to_list()
 
     # copy all files into corresponding directories
     dir_data_relative = dir_data_parent_relative+"dataset_split_categories/"
@@ -0,0 +1,208 @@
+import atexit
+import sqlite3
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+
+
+FILEPATH_SIGHTINGS_DB = "../data/sightings.sqlite"  # default location of the sightings database
+POINTS_PER_SIGHTING = 10  # points scored for every identified animal (blank scenes score nothing)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    name TEXT PRIMARY KEY,
+    score INTEGER NOT NULL DEFAULT 0,
+    n_sightings INTEGER NOT NULL DEFAULT 0,
+    avatar TEXT
+);
+CREATE TABLE IF NOT EXISTS sightings (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    animal TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    created REAL NOT NULL,
+    image_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS animal_counts (
+    animal TEXT PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_users_score ON users (score DESC, name);
+CREATE INDEX IF NOT EXISTS idx_sightings_user ON sightings (user, created);
+CREATE INDEX IF NOT EXISTS idx_sightings_animal ON sightings (animal);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_sightings_user_image ON sightings (user, image_hash);
+"""
+
+
+@lru_cache(maxsize=None)
+def get_connection(filepath: str = FILEPATH_SIGHTINGS_DB) -> sqlite3.Connection:
+    """Return the SQLite connection to a database file, opened once per process in WAL mode.
+
+    Args:
+        filepath (str, optional): path of the database file. Defaults to FILEPATH_SIGHTINGS_DB.
+
+    Returns:
+        sqlite3.Connection: the cached connection (may be shared between threads, access has to be serialized by the caller).
+    """
+
+    connection = sqlite3.connect(filepath, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")  # readers of other processes are not blocked by writes
+    connection.execute("PRAGMA synchronous=NORMAL")  # safe in WAL mode and avoids an fsync per transaction
+    # databases created before image hashes were stored lack the column
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(sightings)")}
+    if columns and "image_hash" not in columns:
+        connection.execute("ALTER TABLE sightings ADD COLUMN image_hash TEXT")
+    connection.executescript(_SCHEMA)
+    connection.commit()
+
+    return connection
+
+
+class SightingsStore:
+    """Persistent store for the sightings and scores of all app users.
+
+    New sightings are buffered in memory and written in batches (a single transaction per batch). The buffer is flushed
+    when it holds batch_size sightings, when the oldest buffered sighting is older than max_delay seconds, before every
+    query and at interpreter exit. Totals per user and per animal are maintained incrementally, so leaderboard and count
+    queries are index lookups whose cost does not grow with the number of sightings.
+    """
+
+    def __init__(self, filepath: str = FILEPATH_SIGHTINGS_DB, batch_size: int = 100, max_delay: float = 5.0):
+        """
+        Args:
+            filepath (str, optional): path of the database file. Defaults to FILEPATH_SIGHTINGS_DB.
+            batch_size (int, optional): Number of buffered sightings that triggers a write. Defaults to 100.
+            max_delay (float, optional): Maximum time in seconds a sighting stays in the buffer. Defaults to 5.0.
+        """
+
+        self._connection = get_connection(filepath)
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._buffer = []
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def add_users(self, users: list[tuple[str, str | None]]) -> None:
+        """Register users (with an optional avatar image path), keeping existing users unchanged.
+
+        Args:
+            users (list[tuple[str, str | None]]): list of (name, avatar) tuples.
+
+        Returns:
+            None: None
+        """
+
+        with self._lock:
+            self._connection.executemany("INSERT OR IGNORE INTO users (name, avatar) VALUES (?, ?)", users)
+            self._connection.commit()
+
+        return None
+
+    def record_sighting(self, user: str, animal: str, confidence: float, image_hash: str | None = None) -> None:
+        """Buffer a classified sighting of a user. Repeated sightings of the same image by the same user are ignored (not scored).
+
+        Args:
+            user (str): the user name.
+            animal (str): the identified class label.
+            confidence (float): the prediction confidence in [0, 1].
+            image_hash (str | None, optional): hash of the image file, used for recognizing repeated uploads. Defaults to None (no check).
+
+        Returns:
+            None: None
+        """
+
+        with self._lock:
+            self._buffer.append((user, animal, float(confidence), time.time(), image_hash))
+            if len(self._buffer) >= self.batch_size or time.time() - self._buffer[0][3] > self.max_delay:
+                self._flush_locked()
+
+        return None
+
+    def flush(self) -> None:
+        """Write all buffered sightings to the database.
+
+        Returns:
+            None: None
+        """
+
+        with self._lock:
+            self._flush_locked()
+
+        return None
+
+    def _flush_locked(self) -> None:
+        """Write all buffered sightings in a single transaction (the lock must be held)."""
+
+        if not self._buffer:
+            return None
+
+        with self._connection:  # commits the transaction (or rolls it back on errors)
+            # repeated (user, image) pairs violate the unique index and are skipped
+            inserted = [sighting for sighting in self._buffer
+                        if self._connection.execute("INSERT OR IGNORE INTO sightings (user, animal, confidence, created, image_hash) VALUES (?, ?, ?, ?, ?)",
+                                                    sighting).rowcount == 1]
+
+            # aggregate the score and count updates of the batch before touching the tables
+            points_per_user = Counter()
+            sightings_per_user = Counter()
+            sightings_per_animal = Counter()
+            for user, animal, _, _, _ in inserted:
+                sightings_per_user[user] += 1
+                sightings_per_animal[animal] += 1
+                if animal != "blank":
+                    points_per_user[user] += POINTS_PER_SIGHTING
+
+            self._connection.executemany("""INSERT INTO users (name, score, n_sightings) VALUES (?, ?, ?)
+                                            ON CONFLICT (name) DO UPDATE SET score = score + excluded.score,
+                                                                             n_sightings = n_sightings + excluded.n_sightings""",
+                                         [(user, points_per_user[user], n) for user, n in sightings_per_user.items()])
+            self._connection.executemany("""INSERT INTO animal_counts (animal, count) VALUES (?, ?)
+                                            ON CONFLICT (animal) DO UPDATE SET count = count + excluded.count""",
+                                         list(sightings_per_animal.items()))
+        self._buffer = []
+
+        return None
+
+    def top_users(self, n: int = 5) -> list[tuple[str, int, str | None]]:
+        """Return the users with the highest scores.
+
+        Args:
+            n (int, optional): Number of users. Defaults to 5.
+
+        Returns:
+            list[tuple[str, int, str | None]]: list of (name, score, avatar) tuples, sorted by decreasing score.
+        """
+
+        with self._lock:
+            self._flush_locked()
+            return self._connection.execute("SELECT name, score, avatar FROM users ORDER BY score DESC, name LIMIT ?", (n,)).fetchall()
+
+    def user_score(self, user: str) -> tuple[int, int]:
+        """Return the score and the rank of a user.
+
+        Args:
+            user (str): the user name.
+
+        Returns:
+            tuple[int, int]: 2-tuple containing (score, rank) ((0, 0) for unknown users).
+        """
+
+        with self._lock:
+            self._flush_locked()
+            row = self._connection.execute("SELECT score FROM users WHERE name = ?", (user,)).fetchone()
+            if row is None:
+                return 0, 0
+            n_better = self._connection.execute("SELECT COUNT(*) FROM users WHERE score > ?", (row[0],)).fetchone()[0]
+            return row[0], n_better + 1
+
+    def animal_counts(self) -> dict[str, int]:
+        """Return the number of sightings per animal.
+
+        Returns:
+            dict[str, int]: dictionary mapping each animal label to its number of sightings.
+        """
+
+        with self._lock:
+            self._flush_locked()
+            return dict(self._connection.execute("SELECT animal, count FROM animal_counts ORDER BY animal").fetchall())
@@ -0,0 +1,230 @@
+import os
+import json
+import heapq
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import cv2 as cv
+import tensorflow as tf
+
+from metadata import DIR_DATA_RELATIVE, LABEL_COLUMNS, load_metadata
+from image_headers import drop_corrupt_images
+
+
+DIR_TFRECORDS = DIR_DATA_RELATIVE + "tfrecords/"  # default output directory of the TFRecord shards
+MANIFEST_FILENAME = "manifest.json"
+
+_FEATURE_DESCRIPTION = {
+    "image": tf.io.FixedLenFeature([], tf.string),
+    "label": tf.io.FixedLenFeature([], tf.int64),
+    "id": tf.io.FixedLenFeature([], tf.string),
+}
+
+
+def assign_shards(file_sizes: np.ndarray, n_shards: int) -> np.ndarray:
+    """Distribute files over shards such that the shards have similar total sizes (greedy longest-processing-time assignment).
+
+    Args:
+        file_sizes (np.ndarray): the size of every file in bytes.
+        n_shards (int): number of shards.
+
+    Returns:
+        np.ndarray: the shard index of every file.
+    """
+
+    file_sizes = np.asarray(file_sizes)
+    shard_indices = np.empty(file_sizes.shape[0], dtype=np.int64)
+    heap = [(0, shard) for shard in range(n_shards)]  # (total size, shard index)
+    for i in np.argsort(-file_sizes, kind="stable"):
+        total_size, shard = heapq.heappop(heap)
+        shard_indices[i] = shard
+        heapq.heappush(heap, (total_size + int(file_sizes[i]), shard))
+
+    return shard_indices
+
+
+def _encode_image(filepath: str, resize_to: tuple[int, int] | None) -> bytes:
+    """Return the JPEG bytes of an image, optionally resized and padded to (height, width) first."""
+
+    if resize_to is None:
+        with open(filepath, "rb") as file:
+            return file.read()
+
+    img = cv.imread(filepath)
+    height, width = resize_to
+    scale = min(height / img.shape[0], width / img.shape[1])
+    img_resized = cv.resize(img, (round(img.shape[1] * scale), round(img.shape[0] * scale)), interpolation=cv.INTER_AREA)
+
+    # pad centrally, like tf.image.resize_with_pad
+    img_padded = np.zeros((height, width, 3), dtype=np.uint8)
+    offset_y = (height - img_resized.shape[0]) // 2
+    offset_x = (width - img_resized.shape[1]) // 2
+    img_padded[offset_y:offset_y+img_resized.shape[0], offset_x:offset_x+img_resized.shape[1]] = img_resized
+
+    return cv.imencode(".jpg", img_padded, [cv.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+
+
+def _write_shard(filepath_shard: str, filepaths: list[str], labels: list[int], ids: list[str], resize_to: tuple[int, int] | None) -> dict:
+    """Write the records of one shard and return its manifest entry."""
+
+    with tf.io.TFRecordWriter(filepath_shard) as writer:
+        for filepath, label, ID in zip(filepaths, labels, ids):
+            example = tf.train.Example(features=tf.train.Features(feature={
+                "image": tf.train.Feature(bytes_list=tf.train.BytesList(value=[_encode_image(filepath, resize_to)])),
+                "label": tf.train.Feature(int64_list=tf.train.Int64List(value=[label])),
+                "id": tf.train.Feature(bytes_list=tf.train.BytesList(value=[ID.encode()])),
+            }))
+            writer.write(example.SerializeToString())
+
+    return {"filename": os.path.basename(filepath_shard), "n_records": len(filepaths), "n_bytes": os.path.getsize(filepath_shard)}
+
+
+def export_split_to_tfrecords(split: str,
+                              n_shards: int | None = None,
+                              target_shard_size_mb: float = 100.0,
+                              resize_to: tuple[int, int] | None = None,
+                              n_jobs: int | None = None,
+                              dir_output: str = DIR_TFRECORDS,
+                              seed: int = 42) -> dict:
+    """Export a dataset split into size-balanced TFRecord shards (written in parallel) plus a JSON manifest.
+
+    Args:
+        split (str): the dataset split ("train", "val" or "test").
+        n_shards (int | None, optional): number of shards. Defaults to None, which derives it from target_shard_size_mb.
+        target_shard_size_mb (float, optional): approximate shard size in MB (only used if n_shards is None). Defaults to 100.0.
+        resize_to (tuple[int, int] | None, optional): (height, width) the images are resized and padded to before storing. Defaults to None (original JPEG bytes).
+        n_jobs (int | None, optional): Number of worker processes. Defaults to None, which uses all available cores.
+        dir_output (str, optional): output parent directory (the shards are written into a subdirectory named after the split). Defaults to DIR_TFRECORDS.
+        seed (int, optional): random seed for shuffling the records before sharding. Defaults to 42.
+
+    Returns:
+        dict: the manifest.
+    """
+
+    df = drop_corrupt_images(load_metadata(split, columns=["id", "filepath"] + LABEL_COLUMNS))
+    df = df.sample(frac=1.0, random_state=seed)  # mix sites and classes across the shards
+    filepaths = (DIR_DATA_RELATIVE + df.filepath).to_numpy()
+    labels = df[LABEL_COLUMNS].to_numpy().argmax(axis=1)
+    ids = df.id.to_numpy(dtype=str)
+
+    file_sizes = np.array([os.path.getsize(filepath) for filepath in filepaths], dtype=np.int64)
+    if n_shards is None:
+        n_shards = max(1, int(np.ceil(file_sizes.sum() / (target_shard_size_mb * 1024**2))))
+    shard_indices = assign_shards(file_sizes, n_shards)
+
+    dir_split = os.path.join(dir_output, split)
+    os.makedirs(dir_split, exist_ok=True)
+
+    # one task per shard. spawned workers do not inherit the TensorFlow runtime state of this process
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = []
+        for shard in range(n_shards):
+            mask = shard_indices == shard
+            filepath_shard = os.path.join(dir_split, f"{split}-{shard:05d}-of-{n_shards:05d}.tfrecord")
+            futures.append(executor.submit(_write_shard, filepath_shard, filepaths[mask].tolist(), labels[mask].tolist(), ids[mask].tolist(), resize_to))
+        shards = [future.result() for future in futures]
+
+    manifest = {
+        "split": split,
+        "n_records": int(len(df)),
+        "n_shards": n_shards,
+        "resize_to": list(resize_to) if resize_to is not None else None,
+        "label_columns": LABEL_COLUMNS,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "shards": shards,
+    }
+    with open(os.path.join(dir_split, MANIFEST_FILENAME), "w") as file:
+        json.dump(manifest, file, indent=2)
+
+    return manifest
+
+
+def load_manifest(split: str, dir_input: str = DIR_TFRECORDS) -> dict:
+    """Load the manifest of an exported split.
+
+    Args:
+        split (str): the dataset split ("train", "val" or "test").
+        dir_input (str, optional): parent directory of the exported splits. Defaults to DIR_TFRECORDS.
+
+    Returns:
+        dict: the manifest.
+    """
+
+    with open(os.path.join(dir_input, split, MANIFEST_FILENAME)) as file:
+        return json.load(file)
+
+
+def load_tfrecord_dataset(split: str,
+                          batch_size: int = 64,
+                          num_workers: int = 1,
+                          worker_index: int = 0,
+                          shuffle: bool = True,
+                          seed: int = 42,
+                          image_size: tuple[int, int] | None = None,
+                          cycle_length: int = 8,
+                          dir_input: str = DIR_TFRECORDS) -> tf.data.Dataset:
+    """Read an exported split, interleaving its shards. With several workers, every worker reads a disjoint, deterministic subset of the shards.
+
+    The returned dataset is already sharded, so automatic sharding by tf.distribute is switched off. Every worker reads the
+    same number of records (the smallest per-worker total according to the manifest), since uneven per-worker step counts
+    stall synchronous multi-worker training at the end of an epoch; the surplus records of the other workers are skipped.
+
+    Args:
+        split (str): the dataset split ("train", "val" or "test").
+        batch_size (int, optional): (per-worker) batch size. Defaults to 64.
+        num_workers (int, optional): total number of reading workers. Defaults to 1.
+        worker_index (int, optional): index of this worker in [0, num_workers). Defaults to 0.
+        shuffle (bool, optional): Boolean switch for shuffling the shard order and the records. Defaults to True.
+        seed (int, optional): random seed. Defaults to 42.
+        image_size (tuple[int, int] | None, optional): (height, width) the images are resized and padded to. Defaults to None,
+            which uses the size the images were stored with (requires an export with resize_to).
+        cycle_length (int, optional): number of shards read concurrently. Defaults to 8.
+        dir_input (str, optional): parent directory of the exported splits. Defaults to DIR_TFRECORDS.
+
+    Returns:
+        tf.data.Dataset: dataset of (image, one-hot label) batches.
+    """
+
+    manifest = load_manifest(split, dir_input=dir_input)
+    if manifest["n_shards"] < num_workers:
+        raise ValueError(f"The split '{split}' has {manifest['n_shards']} shards, which is fewer than the {num_workers} workers.")
+    if image_size is None:
+        if manifest["resize_to"] is None:
+            raise ValueError("image_size has to be given for splits exported without resize_to.")
+        image_size = tuple(manifest["resize_to"])
+    n_classes = len(manifest["label_columns"])
+
+    shards = sorted(manifest["shards"], key=lambda shard: shard["filename"])
+    filepaths = [os.path.join(dir_input, split, shard["filename"]) for shard in shards]
+    files = tf.data.Dataset.from_tensor_slices(filepaths).shard(num_workers, worker_index)
+
+    # Dataset.shard assigns the shard i to the worker i % num_workers
+    n_records_per_worker = [sum(shard["n_records"] for shard in shards[index::num_workers]) for index in range(num_workers)]
+    n_records = min(n_records_per_worker)
+    if shuffle:
+        files = files.shuffle(buffer_size=len(filepaths), seed=seed, reshuffle_each_iteration=True)
+
+    def parse(record):
+        example = tf.io.parse_single_example(record, _FEATURE_DESCRIPTION)
+        img = tf.io.decode_jpeg(example["image"], channels=3)
+        img = tf.image.resize_with_pad(img, image_size[0], image_size[1])
+        return img, tf.one_hot(example["label"], n_classes)
+
+    dataset = files.interleave(tf.data.TFRecordDataset,
+                               cycle_length=min(cycle_length, len(filepaths)),
+                               num_parallel_calls=tf.data.AUTOTUNE,
+                               deterministic=True).take(n_records)
+    if shuffle:
+        dataset = dataset.shuffle(buffer_size=8 * batch_size, seed=seed, reshuffle_each_iteration=True)
+    dataset = (dataset
+               .map(parse, num_parallel_calls=tf.data.AUTOTUNE)
+               .batch(batch_size)
+               .prefetch(tf.data.AUTOTUNE))
+
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    options.deterministic = True
+
+    return dataset.with_options(options)
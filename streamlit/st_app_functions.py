@@ -1,13 +1,19 @@
+import sys
 import pydeck as pdk
 import pandas as pd
-import numpy as np
 import matplotlib.pyplot as plt
 import json
 import random
 import base64
+import io
+from functools import lru_cache
 import streamlit as st
 import time
 
+# Import the shared metadata accessor from the functions directory
+sys.path.append("../functions")
+from metadata import LABEL_COLUMNS, load_metadata
+
 # Streams the inputted text with a small time delay
 def get_started(timed_text):
         for word in timed_text.split(" "):
@@ -26,29 +32,24 @@ def user_name():
 
 # Creates the dictionary that contains information about most frequent animal count per site
 def create_dictionary():
-    train_features = pd.read_csv("../data/train_features.csv")
-    train_labels = pd.read_csv("../data/train_labels.csv")
-
-    df = pd.merge(train_features, train_labels, on="id").drop(columns=["filepath", 'id', 'blank'])
-    df.columns = [column.replace('_','/').capitalize() for column in df.columns]
+    # Only the site and the one-hot encoded label columns are needed
+    df = load_metadata("data_info", columns=["site"] + LABEL_COLUMNS)
 
-    # Create array of unique sites
-    array_of_sites = sorted(df.Site.unique())
+    # Count the animals per site (the blank column only takes part in finding the most frequent label)
+    site_counts = df.groupby("site", observed=True)[LABEL_COLUMNS].sum().sort_index()
+    most_frequent = site_counts.idxmax(axis=1)
+    max_counts = site_counts.max(axis=1)
 
-    # Create dictionary to store sites and most frequent animal + counts
+    # Create dictionary to store sites and most frequent animal + counts. Sites dominated by blank scenes are left out
     dictionary = {}
+    for site, animal in most_frequent.items():
+        if animal != "blank":
+            dictionary[site] = (animal.replace('_', '/').capitalize(), max_counts[site])
 
-    # For every site location get the needed information
-    for site in array_of_sites:
-        sites = pd.DataFrame(df.groupby('Site').value_counts()[site].reset_index())
-        for column_name, value in sites.iloc[0].items():
-            if value == 1.0:
-                dictionary[site] = (column_name, sites['count'].max())
-                break
-    
     return dictionary
 
-# Turns images into an html compatible format
+# Turns images into an html compatible format (encoded once per image and process)
+@lru_cache(maxsize=None)
 def get_base64_image(img_path):
     with open(img_path, "rb") as img_file:
         return base64.b64encode(img_file.read()).decode()
@@ -60,6 +61,8 @@ def generate_random_coordinates(min_lat, max_lat, min_lon, max_lon):
     return new_lat, new_lon
 
 # Function to create map dataframe, animal colors dictionary and provides animal location clusters
+# Cached, such that the per-animal aggregates are only computed once per seed and process
+@st.cache_data()
 def create_map_df(seed=None):
     if seed is not None:
         random.seed(seed)
@@ -106,29 +109,57 @@ def create_map_df(seed=None):
     # Create DataFrame from the list of dictionaries
     map_df = pd.DataFrame(data)
 
-   # Calculate weighted mean latitude and longitude for each animal
-    central_points = map_df.groupby('animal_list').apply(lambda x: pd.Series({
-        'latitude': round(np.average(x['latitude'], weights=x['max_count_list']),2),
-        'longitude': round(np.average(x['longitude'], weights=x['max_count_list']),2),
-        'max_count_list': x['max_count_list'].sum()
-    })).reset_index()
+    # Per-animal aggregate table: total counts and count-weighted mean latitude and longitude (vectorized groupby sums)
+    weighted_sums = map_df.assign(
+        latitude=map_df['latitude'] * map_df['max_count_list'],
+        longitude=map_df['longitude'] * map_df['max_count_list']
+    ).groupby('animal_list')[['latitude', 'longitude', 'max_count_list']].sum()
+    central_points = pd.DataFrame({
+        'latitude': (weighted_sums['latitude'] / weighted_sums['max_count_list']).round(2),
+        'longitude': (weighted_sums['longitude'] / weighted_sums['max_count_list']).round(2),
+        'max_count_list': weighted_sums['max_count_list']
+    }).reset_index()
 
     return map_df, animal_colors, central_points
 
+# Loads a GeoJSON file only once per process
+@lru_cache(maxsize=None)
+def load_geojson(path):
+    with open(path) as f:
+        return json.load(f)
+
+# Deck that serializes its layers to JSON only once, such that memoized maps are re-rendered without any recomputation
+class FrozenDeck(pdk.Deck):
+    def to_json(self):
+        if not hasattr(self, "_frozen_json"):
+            self._frozen_json = super().to_json()
+        return self._frozen_json
+
+# Content hash of a DataFrame, used as memo key instead of letting streamlit hash the whole frame
+# (columns holding lists are hashed via their string representation)
+def content_hash(df):
+    object_columns = df.columns[df.dtypes == object]
+    return int(pd.util.hash_pandas_object(df.astype({column: str for column in object_columns})).sum())
+
 # Plots the map using pydeck. Works by creating layers and assembling them into a "Deck"
 # Functionality allows for animals to be selected with the checkbox. Applies the filter to the map_df 
+# The deck is memoized by the frozenset of selected animals and the content of the map data
 def plot_graph(selected_animals, map_df, central_points, show_clusters=False):
+    data_key = (content_hash(map_df), content_hash(central_points))
+    return _plot_graph_memoized(frozenset(selected_animals), show_clusters, data_key, map_df, central_points)
+
+# Arguments with a leading underscore are not hashed by streamlit, they are identified by data_key instead
+@st.cache_resource(max_entries=512)
+def _plot_graph_memoized(selected_animals, show_clusters, data_key, _map_df, _central_points):
+    map_df, central_points = _map_df, _central_points
 
     # Filter map_df based on the selected animals
     filtered_df = map_df[map_df['animal_list'].isin(selected_animals)]
     filtered_central_points = central_points[central_points['animal_list'].isin(selected_animals)]
 
     # Load upper and lower boundaries of the park from GeoJSON files
-    with open("export_upper.geojson") as f:
-        upper_boundary_geojson = json.load(f)
-
-    with open("export_lower.geojson") as f:
-        lower_boundary_geojson = json.load(f)
+    upper_boundary_geojson = load_geojson("export_upper.geojson")
+    lower_boundary_geojson = load_geojson("export_lower.geojson")
 
     # Create a text layer
     text_layer1 = pdk.Layer(
@@ -222,7 +253,7 @@ def plot_graph(selected_animals, map_df, central_points, show_clusters=False):
         if not filtered_df.empty:
             layers.append(animal_layer)
 
-    r = pdk.Deck(
+    r = FrozenDeck(
         layers=layers,
         initial_view_state=view_state,
         map_style="mapbox://styles/mapbox/satellite-streets-v11",
@@ -233,16 +264,12 @@ def plot_graph(selected_animals, map_df, central_points, show_clusters=False):
 
 # Creates bar plot with checkboxed animals
 def animal_counts_plotted(selected_animals, map_df, bar_width=0.8, figsize=(5,5)):
-    dict2 = {}
-    # Filter map_df based on the selected animals
-    filtered_df_2 = map_df[map_df['animal_list'].isin(selected_animals)]
+    # Sum the counts of all animals at once and pick the selected ones (animals without sites count 0)
+    dict2 = map_df.groupby('animal_list')['max_count_list'].sum().reindex(list(selected_animals), fill_value=0).to_dict()
 
      # Define colors
     background_color = 'black'
     element_color = 'lightgrey'
-
-    for animal in selected_animals:
-        dict2[animal] = filtered_df_2.query("animal_list == @animal")["max_count_list"].sum()
     
     # Create the matplotlib figure
     fig, ax = plt.subplots(figsize=figsize)
@@ -259,7 +286,7 @@ def animal_counts_plotted(selected_animals, map_df, bar_width=0.8, figsize=(5,5)
         list(dict2.values()), 
         width=bar_width, 
         color=element_color, 
-        tick_label=selected_animals
+        tick_label=list(dict2.keys())
         )
     ax.set_title(
         label='Animal sightings',
@@ -289,4 +316,15 @@ def animal_counts_plotted(selected_animals, map_df, bar_width=0.8, figsize=(5,5)
     # Return the figure
     return fig
 
-    
+# Renders the bar plot to PNG bytes, memoized by the frozenset of selected animals and the content of the map data
+def animal_counts_png(selected_animals, map_df, bar_width=0.8, figsize=(5,5)):
+    return _animal_counts_png_memoized(frozenset(selected_animals), content_hash(map_df), map_df, bar_width, figsize)
+
+@st.cache_resource(max_entries=256)
+def _animal_counts_png_memoized(selected_animals, data_key, _map_df, bar_width, figsize):
+    # Keep a fixed (alphabetical) order of the bars, independent of the selection order
+    fig = animal_counts_plotted(sorted(selected_animals), _map_df, bar_width=bar_width, figsize=figsize)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", transparent=True, bbox_inches="tight")
+    plt.close(fig)
+    return buffer.getvalue()
@@ -1,14 +1,20 @@
 import streamlit as st
+import hashlib
+import html
+import os
 import sys
 import time
-import pandas as pd
 import numpy as np
 from PIL import Image
 import tensorflow as tf
 
 # Import functions with relative path
 #sys.path.append(".")
-from st_app_functions import get_started, user_name, create_map_df, plot_graph, animal_counts_plotted, get_base64_image
+from st_app_functions import get_started, user_name, create_map_df, plot_graph, animal_counts_png, get_base64_image
+from blank_prefilter import load_blank_prefilter, thumbnail_from_bytes, is_confidently_blank, predict_blank_probabilities
+from prediction_cache import PredictionCache, get_model_version
+from sightings_store import SightingsStore
+from metadata import LABEL_COLUMNS
 
 # Define a random seed
 random_seed = 42
@@ -36,9 +42,42 @@ st.sidebar.markdown("---")
 @st.cache_resource()
 def load_model():
     print("\nLoading model!!\n")
-    return tf.keras.models.load_model("../models/ConvNeXtXLarge_v2.keras")
+    return tf.keras.models.load_model(model_path)
+model_path = "../models/ConvNeXtXLarge_v2.keras"
 model = load_model()
 
+# Cheap blank scene prefilter, which is run ahead of the heavy classifier (None if no fitted prefilter exists)
+@st.cache_resource()
+def load_prefilter():
+    return load_blank_prefilter(prefilter_path)
+prefilter_path = "../models/blank_prefilter.pkl"
+prefilter = load_prefilter()
+
+# Cached predictions are only valid for the same classifier and prefilter (blank answers may come from the prefilter)
+model_version = get_model_version(model_path)
+if os.path.exists(prefilter_path):
+    model_version += "|" + get_model_version(prefilter_path)
+
+# Prediction cache shared by all sessions, so re-uploaded images are not classified again
+@st.cache_resource()
+def load_prediction_cache():
+    return PredictionCache(max_entries=1024, filepath_sqlite="../models/prediction_cache.sqlite")
+prediction_cache = load_prediction_cache()
+
+# Persistent sightings and leaderboard store shared by all sessions. The placeholder users are registered on first use
+@st.cache_resource()
+def load_sightings_store():
+    store = SightingsStore("../data/sightings.sqlite")
+    store.add_users([
+        ("J. Goodall", "JG.bmp"),
+        ("T. Stark", "TS.png"),
+        ("Cpt. J. Sparrow", "CJS.bmp"),
+        ("Hulk", "H.bmp"),
+        ("R2D2", "R2.bmp"),
+    ])
+    return store
+sightings_store = load_sightings_store()
+
 class_labels = ['an antelope/duiker', 'a bird', 'a blank scene', 'a civet/genet', 'a hog', 'a leopard', 'a monkey/prosimian', 'a rodent']
 
 if tabs == "Get Started":
@@ -62,6 +101,8 @@ if tabs == "Get Started":
         text_input = user_name()
 
         if text_input:
+            # Keep the user name for the leaderboard (widget states are dropped when switching tabs)
+            st.session_state.user_name = text_input
             text_to_write = f"Hello {text_input}! If you want a little assistance with planning your trip today, please click the 'Trip Planner' icon.\n If you want to get animals on your pictures identified please go to 'My Sightings'."
             st.write_stream(get_started(text_to_write))
             st.session_state.disabled = True
@@ -141,8 +182,7 @@ elif tabs == "Trip Planner":
             pydeck_map = plot_graph(selected_animals, map_df, central_points)
             map_placeholder.pydeck_chart(pydeck_map)
             # Bar plot generated at placeholder space
-            fig = animal_counts_plotted(selected_animals, map_df)
-            graph_container.pyplot(fig)
+            graph_container.image(animal_counts_png(selected_animals, map_df))
         else:
             # Create the default map only if the "Plot" button is not clicked
             pydeck_map = plot_graph([], map_df, central_points)
@@ -160,13 +200,10 @@ elif tabs == "Trip Planner":
             map_placeholder.pydeck_chart(pydeck_map)
             
             graph_container.empty()
-            animal_coordinates = []
             # To create table at position where the bar plot was
-            for _, row in central_points.iterrows():
-                if row['animal_list'] in selected_animals:
-                    animal_coordinates.append([row['animal_list'], row['latitude'], row['longitude']])
-            if animal_coordinates:
-                animal_df = pd.DataFrame(animal_coordinates, columns=['Animal', 'Lat', 'Long'])
+            animal_df = central_points.loc[central_points['animal_list'].isin(selected_animals), ['animal_list', 'latitude', 'longitude']]
+            if not animal_df.empty:
+                animal_df = animal_df.set_axis(['Animal', 'Lat', 'Long'], axis=1).reset_index(drop=True)
                 graph_container.write(animal_df)
             else:
                 graph_container.write("No animals selected.")
@@ -191,17 +228,22 @@ elif tabs == "My Sightings":
         #x = np.expand_dims(x, axis=0)
         return img_array
 
+    # Classifies an image. The classifier is skipped if the prefilter is confident that the scene is blank
+    # The prefilter thumbnail is decoded from the uploaded file itself, exactly like the thumbnails the prefilter was fit on
+    def classify_image(image):
+        img_array = preprocess_image(image)
+        thumbnail = thumbnail_from_bytes(image.getvalue())[np.newaxis]
+        if prefilter is not None and is_confidently_blank(prefilter, thumbnail)[0]:
+            predictions = np.zeros(len(class_labels), dtype=np.float32)
+            predictions[class_labels.index('a blank scene')] = predict_blank_probabilities(prefilter, thumbnail)[0]
+            return predictions
+        return model.predict(img_array)[0]
+
     with col3:
         st.write("Leaderboard")
 
-        # List of names and corresponding image paths. Placeholder images
-        leaderboard_data = [
-            ("JG.bmp", "J. Goodall"),
-            ("TS.png", "T. Stark"),
-            ("CJS.bmp", "Cpt. J. Sparrow"),
-            ("H.bmp", "Hulk"),
-            ("R2.bmp", "R2D2"),
-        ]
+        # Top users with their scores and image paths. Users without an own image get the logo
+        leaderboard_data = sightings_store.top_users(5)
 
         # Custom CSS to align images and text
         st.markdown("""
@@ -225,12 +267,18 @@ elif tabs == "My Sightings":
             </style>
         """, unsafe_allow_html=True)
 
-        # Display leaderboard with a rank, the image in html compliant format and name of user
-        for rank, (img_path, name) in enumerate(leaderboard_data, start=1):
+        # Display leaderboard with a rank, the image in html compliant format and name of user (names are user input and escaped)
+        for rank, (name, score, img_path) in enumerate(leaderboard_data, start=1):
 
-            img_base64 = get_base64_image(img_path)
+            img_base64 = get_base64_image(img_path or "image_logo.png")
             img_html = f'<img src="data:image/jpeg;base64,{img_base64}" width="100">'
-            st.markdown(f"<div class='leaderboard-item'><span class='leaderboard-rank'>{rank}.</span>{img_html}<span>{name}</span></div>", unsafe_allow_html=True)
+            st.markdown(f"<div class='leaderboard-item'><span class='leaderboard-rank'>{rank}.</span>{img_html}<span>{html.escape(name)} ({score} points)</span></div>", unsafe_allow_html=True)
+
+        # Score and rank of the current user
+        if "user_name" in st.session_state:
+            user_score, user_rank = sightings_store.user_score(st.session_state.user_name)
+            if user_rank:
+                st.write(f"{st.session_state.user_name}: {user_score} points (rank {user_rank})")
 
     # Apply image classification model if image is uploaded and button clicked
     with col4:
@@ -239,24 +287,35 @@ elif tabs == "My Sightings":
             st.image(uploaded_file, caption="Uploaded Image", width=800)
             identify_button_clicked = st.button("Identify Animal")
             if identify_button_clicked:
-                progress_bar = st.progress(0)
-                loading_text = st.text("Loading... 0%")
-                for percent_complete in range(100):
-                    time.sleep(0.02)
-                    loading_text.text(f"Loading... {percent_complete + 1}%")
-                    progress_bar.progress(percent_complete + 1)
                 # Where classification takes place
                 try:
-                    img_array = preprocess_image(uploaded_file)
-                    predictions = model.predict(img_array)
+                    # Look up the image in the prediction cache first, the loading bar is only shown for new images
+                    def classify_with_progress():
+                        progress_bar = st.progress(0)
+                        loading_text = st.text("Loading... 0%")
+                        for percent_complete in range(100):
+                            time.sleep(0.02)
+                            loading_text.text(f"Loading... {percent_complete + 1}%")
+                            progress_bar.progress(percent_complete + 1)
+                        return classify_image(uploaded_file)
+                    image_bytes = uploaded_file.getvalue()
+                    predictions, _ = prediction_cache.get_or_predict(image_bytes, model_version, classify_with_progress)
                     label = np.argmax(predictions)
                     pred_perc = 100.0 * np.max(predictions)
                     print(pred_perc)
                     print(f"pred_perc:.1f")
                     text_to_write = f"Congrats! We are {pred_perc:.1f}% confident that you photographed {class_labels[label]}."
+                    # Record the sighting of named users for the leaderboard (written in batches, repeated uploads of an image are not scored)
+                    if st.session_state.get("user_name"):
+                        sightings_store.record_sighting(st.session_state.user_name, LABEL_COLUMNS[label], pred_perc / 100.0,
+                                                        image_hash=hashlib.sha256(image_bytes).hexdigest())
                     st.write(get_started(text_to_write))
                 except Exception as e:
                     st.error(f"An error occurred: {e}")
                     
 elif tabs == "Info":
-    st.header("Info")
\ No newline at end of file
+    st.header("Info")
+
+    # Hit-rate statistics of the shared prediction cache
+    cache_stats = prediction_cache.stats()
+    st.write(f"Prediction cache: {cache_stats['hits']} hits ({cache_stats['hits_sqlite']} from disk), {cache_stats['misses']} misses, hit rate {100.0 * cache_stats['hit_rate']:.1f}%, {cache_stats['entries']} images in memory")
\ No newline at end of file